@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+## Submission of create-batch workspaces by chunks of sections, with a throttle on the queue depth
+import os, sys, re, json, time, subprocess
+
+def compact_ranges(sections):
+    ## [0,1,2,5,7,8] -> "0-2,5,7-8"
+    ranges = []
+    for s in sorted(sections):
+        if len(ranges) > 0 and ranges[-1][1] == s-1: ranges[-1][1] = s
+        else: ranges.append([s, s])
+    return ",".join("%d" % a if a == b else "%d-%d" % (a, b) for a, b in ranges)
+
+class Workspace:
+    ## A create-batch job directory, marked by .create-batch, and its submission state
+    def __init__(self, jobDir, priority=0):
+        self.jobDir = os.path.abspath(jobDir)
+        self.priority = priority
+        self.meta = {}
+        try:
+            with open(os.path.join(self.jobDir, '.create-batch')) as f: self.meta = json.load(f)
+        except ValueError:
+            pass ## Empty tag file of the older create-batch
+        self.nSection = self.meta.get('nSection', None)
+        if self.nSection is None: self.nSection = self.readQueueSize()
+        self.stateFile = os.path.join(self.jobDir, 'submit_state.json')
+        self.submitted = set()
+        self.clusters = {} ## cluster: [sections] of the partial submissions, in the order of the process numbers
+        if os.path.exists(self.stateFile):
+            with open(self.stateFile) as f: state = json.load(f)
+            self.submitted = set(state['submitted'])
+            self.clusters = dict((int(k), v) for k, v in state.get('clusters', {}).items())
+        elif os.path.exists(os.path.join(self.jobDir, 'condor.log')):
+            ## Submitted as a whole by submit.sh
+            self.submitted = set(range(self.nSection or 0))
+
+    def readQueueSize(self):
+        jdsName = os.path.join(self.jobDir, 'submit.jds')
+        if not os.path.exists(jdsName): return None
+        for l in open(jdsName).readlines():
+            m = re.match(r'^\s*queue\s+(\d+)\s*$', l)
+            if m: return int(m.group(1))
+        return None
+
+    def pending(self):
+        return [s for s in range(self.nSection or 0) if s not in self.submitted]
+
+    def saveState(self):
+        tmpName = self.stateFile + ".tmp"
+        with open(tmpName, "w") as f: json.dump({'submitted':sorted(self.submitted), 'clusters':self.clusters}, f)
+        os.replace(tmpName, self.stateFile)
+
+class CondorBackend:
+    def __init__(self, user=None):
+        self.user = user if user is not None else os.environ.get('USER', '')
+
+    def queueDepth(self):
+        ## Number of jobs of the user in the queue, one condor_q call
+        out = subprocess.run(['condor_q', self.user, '-totals'], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True).stdout
+        m = re.search(r'Total for query:\s*(\d+) jobs', out) or re.search(r'^(\d+) jobs;', out, re.M)
+        if m is None: return None
+        return int(m.group(1))
+
+    def submit(self, ws, sections, extraLines=[], jdsName='submit_part.jds'):
+        ## Submit the selected sections with a copy of submit.jds iterating over $(SECTION)
+        jds = open(os.path.join(ws.jobDir, 'submit.jds')).read()
+        jds = jds.replace('$(Process)', '$(SECTION)')
+        queue = "\n".join(list(extraLines)+['queue SECTION in (%s)' % (' '.join(str(s) for s in sections))])
+        jds = re.sub(r'^\s*queue\s+\d+[ \t]*$', lambda m: queue, jds, flags=re.M)
+        with open(os.path.join(ws.jobDir, jdsName), "w") as f: f.write(jds)
+        p = subprocess.run(['condor_submit', jdsName], cwd=ws.jobDir, stdout=subprocess.PIPE, universal_newlines=True)
+        print(p.stdout, end='')
+        ## Process numbers follow the order of the sections, needed to read condor.log
+        m = re.search(r'submitted to cluster (\d+)', p.stdout)
+        if m is not None: ws.clusters[int(m.group(1))] = list(sections)
+        return p.returncode == 0
+
+class FakeBackend:
+    ## Scheduler stand-in for tests and dry runs: each cycle, drainRate jobs leave the queue
+    def __init__(self, depth=0, drainRate=0):
+        self.depth = depth
+        self.drainRate = drainRate
+        self.submissions = []
+
+    def queueDepth(self):
+        depth = self.depth
+        self.depth = max(0, self.depth-self.drainRate)
+        return depth
+
+    def submit(self, ws, sections, extraLines=[], jdsName=None):
+        self.submissions.append((ws.jobDir, list(sections)))
+        self.depth += len(sections)
+        return True
+
+class SubmitThrottle:
+    def __init__(self, backend, maxJobs=2000, chunkSize=500, waitTime=30, saveState=True):
+        self.backend = backend
+        self.maxJobs = maxJobs
+        self.chunkSize = chunkSize
+        self.waitTime = waitTime
+        self.saveState = saveState
+
+    def cycle(self, workspaces):
+        ## One queue query, then fill the free slots in the order of priority. Return number of submitted jobs
+        depth = self.backend.queueDepth()
+        if depth is None:
+            print("!!! Cannot read the queue depth. Wait for the next cycle")
+            return 0
+        free = self.maxJobs - depth
+        nSubmitted = 0
+        for ws in sorted(workspaces, key=lambda x: (-x.priority, x.jobDir)):
+            while free > 0:
+                pending = ws.pending()
+                if len(pending) == 0: break
+                sections = pending[:min(free, self.chunkSize)]
+                ## Record before submitting, a crash must not lead to a double submission
+                ws.submitted.update(sections)
+                if self.saveState: ws.saveState()
+                if not self.backend.submit(ws, sections):
+                    print("!!! Failed to submit sections %s of %s" % (compact_ranges(sections), ws.jobDir))
+                    ws.submitted.difference_update(sections)
+                    if self.saveState: ws.saveState()
+                    break
+                if self.saveState: ws.saveState() ## with the cluster number
+                print("@@ Submitted sections %s of %s" % (compact_ranges(sections), ws.jobDir))
+                free -= len(sections)
+                nSubmitted += len(sections)
+        print("@@ %s queue: %d jobs, submitted %d jobs, %d jobs pending" % (
+              time.strftime("%H:%M:%S"), depth, nSubmitted, sum(len(ws.pending()) for ws in workspaces)))
+        return nSubmitted
+
+    def run(self, workspaces):
+        while True:
+            self.cycle(workspaces)
+            if sum(len(ws.pending()) for ws in workspaces) == 0: break
+            time.sleep(self.waitTime)
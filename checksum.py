@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+## adler32 of local files computed in-process, with a cache keyed by (path, size, mtime)
+import os, sys, mmap, zlib, time, sqlite3, threading, subprocess
+
+blockSize = 8*1024*1024
+
+def adler32_file(fileName):
+    ## Same value as xrdadler32: 8 hex digits, zero padded
+    value = 1
+    with open(fileName, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                view = memoryview(m)
+                for pos in range(0, size, blockSize):
+                    value = zlib.adler32(view[pos:pos+blockSize], value)
+                view.release()
+    return "%08x" % (value & 0xffffffff)
+
+def remote_adler32(url):
+    ## adler32 of a file on a storage, None if the query fails
+    p = subprocess.run(['xrdadler32', url], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    l = p.stdout.split()
+    if p.returncode != 0 or len(l) < 1: return None
+    return l[0].lower().zfill(8)
+
+class ChecksumCache:
+    def __init__(self, fileName):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(fileName, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS adler32 (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, checksum TEXT, updated REAL)")
+        self.db.commit()
+        self.nHit, self.nMiss = 0, 0
+
+    def adler32(self, fileName):
+        path = os.path.abspath(fileName)
+        st = os.stat(path)
+        with self.lock:
+            row = self.db.execute("SELECT size, mtime, checksum FROM adler32 WHERE path=?", (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+            self.nHit += 1
+            return row[2]
+        self.nMiss += 1
+        value = adler32_file(path)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO adler32 VALUES (?,?,?,?,?)", (path, st.st_size, st.st_mtime, value, time.time()))
+            self.db.commit()
+        return value
+
+    def close(self):
+        self.db.close()
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: %s FILE [FILE ...]\nPrint the adler32 of local files like xrdadler32" % sys.argv[0])
+        sys.exit(1)
+    for fileName in sys.argv[1:]:
+        print(adler32_file(fileName), fileName)
@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
 
 import os, subprocess, sys, socket
-from multiprocessing import Pool, Value, Manager
-from itertools import repeat
 
 from optparse import OptionParser
 
@@ -10,41 +8,16 @@ from cmssiteinfo import CMSProtocolInfo
 
 from pipe_open import pipe_open 
 from xrdhelper import XRootDHelper
+from transferengine import TransferEngine, TransferJournal, CommandCopier
+from dirlisting import DirectoryIndex, XRootDLister, make_plan
 
+COPYCMD="xrdcp -p -f {src} {dest}"
 
-def init(total, success, fail):
-    global g_total
-    global g_success
-    global g_fail
-    g_total = total
-    g_success = success
-    g_fail = fail
-
-def migration(lfn, source, dest, return_list):
-    global g_total
-    global g_success
-    global g_fail
-
-    ### 전송 시작 ###
-    cmd = f"xrdcp -p -f root://{source+lfn} root://{dest+lfn}"
-    print(cmd)
-    return_value = os.system(cmd)
-    if( return_value !=0 ):
-        print("%s is failed."%(lfn))
-        with g_fail.get_lock():
-            g_fail.value += 1
-            return_list.append(lfn)
-    else:
-        with g_success.get_lock():
-            g_success.value += 1
-    print("Total: %d / Success: %d / Fail: %d\n"%(g_total.value, g_success.value, g_fail.value))
-    return None
 
 class CMSDownload():
     target=[]
+    target_size={}
     def __init__(self):
-        manager = Manager()
-        self.return_list = manager.list()
         self.hostname = socket.gethostname()
         if ( "sdfarm.kr" not in self.hostname):
             print("This server is not KISTI.")
@@ -55,7 +28,7 @@ class CMSDownload():
         if (os.system("voms-proxy-info -exist -valid 8:0") !=0):
             os.system("voms-proxy-init --voms cms")
         self.parseOptions()
-        self.runDownload()
+        if not self.dryRun: self.runDownload()
     def parseOptions(self):
         usage="Usage: %prog [options] \n(Ex1) %prog --source T2_CH_CERN --dest T2_KR_KISTI -l datalist.txt -p 4\n(Ex2) %prog --source T2_CH_CERN --dest T2_KR_KISTI -d /store/group/phys_heavyions -p 4"
         parser = OptionParser(usage)
@@ -65,8 +38,20 @@ class CMSDownload():
         parser.add_option("-d", "--dirname", dest="dirname", metavar="[DIR]",help="[DIR] name of transfer files")
         parser.add_option("-p", "--parallel", dest="nparallel",default=4, help="number of copy jobs to be run simultaneously")
         parser.add_option("-v", "--verbose", dest="verbose",action="store_true", help="Verbose mode")
+        parser.add_option("-r", "--resume", dest="resume",action="store_true", default=False, help="Skip the files completed in the journal")
+        parser.add_option("-j", "--journal", dest="journal",default="cmsDownload.db", help="Transfer journal (default cmsDownload.db)")
+        parser.add_option("--retries", dest="retries",type="int", default=3, help="Number of retries of a failed copy (default 3)")
+        parser.add_option("--copyCmd", dest="copyCmd",default=COPYCMD, help="Copy command with {src}, {dest} and {key}(LFN) (default \"%s\")"%(COPYCMD))
+        parser.add_option("-c", "--checksum", dest="checksum",action="store_true", default=False, help="Compare adler32 of the files with the same size")
+        parser.add_option("-n", "--dryRun", dest="dryRun",action="store_true", default=False, help="Write the transfer plan only")
         (options, args) = parser.parse_args()
         self.nparallel = int(options.nparallel)
+        self.resume = options.resume
+        self.journal = options.journal
+        self.retries = options.retries
+        self.copyCmd = options.copyCmd
+        self.checksum = options.checksum
+        self.dryRun = options.dryRun
         self.source  = options.source
         self.dest    = options.dest
         self.verbose = options.verbose
@@ -99,14 +84,23 @@ class CMSDownload():
 
     def printTarget(self):
         print(self.target)
+    def site_pfns(self, site, prefix, access=None):
+        ## PFNs of all the targets at once from the storage.json rules of the site, the xrootd prefix otherwise
+        try:
+            pfns = CMSProtocolInfo(site).lfn2pfn(self.target, "XRootD", access)
+        except (OSError, KeyError, ValueError):
+            pfns = [None]*len(self.target)
+        return [pfn or "root://"+prefix+lfn for lfn, pfn in zip(self.target, pfns)]
     def runDownload(self):
-        g_total = Value('i',len(self.target))
-        g_success = Value('i',0)
-        g_fail = Value('i',0)
-        with Pool(initializer = init, initargs = (g_total, g_success, g_fail,), processes = self.nparallel) as p:
-            p.starmap(migration, zip(self.target,repeat(self.source_prefix),repeat(self.dest_prefix),repeat(self.return_list) ))
+        srcPfns = self.site_pfns(self.source, self.source_prefix)
+        destPfns = self.site_pfns(self.dest, self.dest_prefix, ["global-rw", "site-rw"])
+        tasks = [(lfn, src, dest, self.target_size.get(lfn)) for lfn, src, dest in zip(self.target, srcPfns, destPfns)]
+        journal = TransferJournal(self.journal)
+        engine = TransferEngine(CommandCopier(self.copyCmd, self.verbose), nParallel=self.nparallel, retries=self.retries, journal=journal)
+        failed_list = engine.run(tasks, resume=self.resume)
+        journal.close()
         with open("failed_list.txt","w") as f:
-            for failed_file in self.return_list:
+            for failed_file in failed_list:
                 f.write("%s\n"%failed_file)
     def check_files(self,lfns):
         srcxh = XRootDHelper(self.source)
@@ -114,30 +108,23 @@ class CMSDownload():
         self.source_prefix = srcxh.get_prefix()
         self.dest_prefix = destxh.get_prefix()
         print(f"Total target files : {len(lfns)}") 
-        for lfn in lfns:
-            ## 송신측 파일 존재여부 확인
-            if(not srcxh.isfile(lfn)):
-                print("Wrong Source file.")
-                continue
-            if(destxh.isfile(lfn)):
-                source_filesize = srcxh.get_filesize(lfn)
-                dest_filesize = destxh.get_filesize(lfn)
-                ## 송신측 과 수신측의 파일 상태 확인 / 파일 사이즈 비교
-                if (source_filesize == dest_filesize):
-                    print("동일 파일 발견.")
-                    continue
-                else:
-                    if self.verbose:
-                        print("Verbose mode: Add %s to list"%(lfn))
-                    self.target.append(lfn)
-            else:
-                self.target.append(lfn)
+        ## 디렉토리 단위로 양쪽을 한 번씩 조회 / 파일 사이즈(및 adler32) 비교
+        source = DirectoryIndex(XRootDLister(self.source_prefix), self.nparallel*4)
+        dest = DirectoryIndex(XRootDLister(self.dest_prefix), self.nparallel*4)
+        plan = make_plan(lfns, source, dest, checksum=self.checksum)
+        for lfn in plan.missing:
+            print("Wrong Source file. (%s)"%(lfn))
+        if self.verbose:
+            for lfn, size, reason in plan.copy:
+                print("Verbose mode: Add %s to list (%s)"%(lfn, reason))
+        self.target = [x[0] for x in plan.copy]
+        self.target_size = dict((x[0], x[1]) for x in plan.copy)
+        plan.write("transfer_plan.txt")
+        print(plan.summary())
 
 
 if __name__ == '__main__':
 
-    lfn_list=[]
-    failed_list=[]
     CMSDownload()
         
 
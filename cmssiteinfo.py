@@ -1,28 +1,133 @@
 #!/usr/bin/env python3
 
-import os, sys
+## Storage description of the CMS sites from SITECONF/<site>/storage.json, and the LFN to PFN translation
+## A protocol has a prefix (PFN = prefix+LFN) or rules {lfn: regex, pfn: template with $1.., chain: protocol},
+## tried in order on the whole LFN, the first match gives the PFN. With chain, the LFN is first translated by
+## the chained protocol. The parsed files are cached in the process and in ~/.cache/cmssiteinfo, both
+## invalidated by the mtime of storage.json, and the compiled rules are reused for all the translations.
+import os, sys, re
 import json
 
+siteconfDir = "/cvmfs/cms.cern.ch/SITECONF"
+cacheDir = os.path.expanduser("~/.cache/cmssiteinfo")
+_storageCache = {} ## storage.json path: (mtime, volumes)
+
+def load_storage(sitename, siteconf=siteconfDir, cache=cacheDir):
+    ## List of the volumes in storage.json, OSError if the file cannot be read
+    infile = os.path.join(siteconf, sitename, "storage.json")
+    mtime = os.stat(infile).st_mtime
+    cached = _storageCache.get(infile)
+    if cached is not None and cached[0] == mtime: return cached[1]
+
+    volumes = None
+    cacheFile = os.path.join(cache, sitename+".json") if cache else None
+    if cacheFile is not None:
+        try:
+            with open(cacheFile) as f: c = json.load(f)
+            if c['path'] == infile and c['mtime'] == mtime: volumes = c['volumes']
+        except (OSError, ValueError, KeyError):
+            pass
+    if volumes is None:
+        with open(infile) as f: volumes = json.load(f)
+        if cacheFile is not None:
+            try:
+                os.makedirs(cache, exist_ok=True)
+                tmpName = "%s.%d.tmp" % (cacheFile, os.getpid())
+                with open(tmpName, "w") as f: json.dump({'path':infile, 'mtime':mtime, 'volumes':volumes}, f)
+                os.replace(tmpName, cacheFile)
+            except OSError:
+                pass
+    _storageCache[infile] = (mtime, volumes)
+    return volumes
+
+def pfn_template(pfn):
+    ## $1 of storage.json to {0} of str.format, which is much faster than Match.expand on large lists
+    return re.sub(r'\$(\d+)', lambda m: '{%d}' % (int(m.group(1))-1), pfn.replace('{', '{{').replace('}', '}}'))
+
 class CMSProtocolInfo:
-    def __init__(self, sitename):
-        self.protocol={}
-        if( os.path.isdir("/cvmfs/cms.cern.ch")):
-            infile = f"/cvmfs/cms.cern.ch/SITECONF/{sitename}/storage.json"
-            with open(infile) as f:
-                cfg = json.load(f)
-                for prtc in cfg[0]["protocols"]:
-                    self.protocol[prtc['protocol']] = prtc['prefix']
-                self.sitename = sitename
-        else:
-            print("CVMFS is not mounted")
-            sys.exit(-1)
+    def __init__(self, sitename, volume=None, siteconf=siteconfDir, cache=cacheDir):
+        if not os.path.isdir(siteconf): raise OSError("CVMFS is not mounted, no %s" % siteconf)
+        volumes = load_storage(sitename, siteconf, cache)
+        if volume is not None: volumes = [x for x in volumes if x.get('volume') == volume]
+        if len(volumes) == 0: raise OSError("No volume %s in the storage.json of %s" % (volume, sitename))
+        self.sitename = sitename
+        self.volume = volumes[0].get('volume')
+        self.protocols = volumes[0]["protocols"]
+        self.protocol = {}
+        for prtc in self.protocols:
+            self.protocol[prtc['protocol']] = prtc.get('prefix')
+        self.rules = {} ## id of the protocol entry: [(compiled lfn, pfn template, chain)]
+
     def print_protocol(self):
         print(self.sitename)
         print(self.protocol)
-    def get_prefix(self,protocol):
-        print(self.protocol[protocol])
+
+    def find(self, protocol, access=None):
+        ## First entry of the protocol, access is one value or a list of them in the order of preference
+        accesses = [None] if access is None else [access] if isinstance(access, str) else access
+        for a in accesses:
+            for prtc in self.protocols:
+                if prtc['protocol'] == protocol and (a is None or prtc.get('access') == a): return prtc
+        raise KeyError("No protocol %s%s for %s" % (protocol, "" if access is None else " with access %s" % access, self.sitename))
+
+    def compiled_rules(self, prtc):
+        key = id(prtc)
+        if key not in self.rules:
+            self.rules[key] = [(re.compile(r['lfn']), pfn_template(r['pfn']), r.get('chain')) for r in prtc.get('rules', [])]
+        return self.rules[key]
+
+    def lfn2pfn(self, lfns, protocol="XRootD", access=None, depth=0):
+        ## PFNs of a list of LFNs, None for the LFNs matched by no rule.
+        ## The rules are applied one after the other on the whole list, each to the LFNs not matched yet
+        prtc = self.find(protocol, access)
+        if prtc.get('prefix') is not None: return [prtc['prefix']+lfn for lfn in lfns]
+        if depth > 10: raise ValueError("Chain loop in the rules of %s for %s" % (protocol, self.sitename))
+        pfns = [None]*len(lfns)
+        pending = list(range(len(lfns)))
+        for pattern, template, chain in self.compiled_rules(prtc):
+            if len(pending) == 0: break
+            inputs = [lfns[i] for i in pending]
+            if chain is not None: inputs = self.lfn2pfn(inputs, chain, depth=depth+1)
+            match, fmt = pattern.fullmatch, template.format
+            left = []
+            for i, x in zip(pending, inputs):
+                m = None if x is None else match(x)
+                if m is None: left.append(i)
+                else: pfns[i] = fmt(*m.groups(''))
+            pending = left
+        return pfns
+
+    def get_prefix(self, protocol, access=None):
+        ## Prefix of the protocol, for the rules the PFN of /store/ without store/
+        prtc = self.find(protocol, access)
+        if prtc.get('prefix') is not None: return prtc['prefix']
+        pfn = self.lfn2pfn(["/store/"], protocol, access)[0]
+        if pfn is None or not pfn.endswith("/store/"): return None
+        return pfn[:-len("store/")]
+
+    def get_xrootd_prefix(self, access=None):
+        ## host[:port]//base of the XRootD protocol, the form used by the dirlisting listers
+        prefix = self.get_prefix("XRootD", access)
+        if prefix is None or not prefix.startswith("root://"): return None
+        return prefix[len("root://"):].rstrip('/')
 
 if __name__== "__main__":
-    cp = CMSProtocolInfo("T3_KR_KISTI")
-    cp.print_protocol()
-    cp.get_prefix("XRootD")
+    if len(sys.argv) < 2:
+        print("Usage: %s SITE [PROTOCOL [LFNFILE]]\nPrint the protocols of the site, or the PFNs of the LFNs (stdin with -)" % sys.argv[0])
+        sys.exit(1)
+    try:
+        cp = CMSProtocolInfo(sys.argv[1])
+    except OSError as e:
+        print("!!!", e)
+        sys.exit(-1)
+    if len(sys.argv) == 2:
+        cp.print_protocol()
+        sys.exit(0)
+    if len(sys.argv) == 3:
+        print(cp.get_prefix(sys.argv[2]))
+        sys.exit(0)
+    f = sys.stdin if sys.argv[3] == '-' else open(sys.argv[3])
+    lfns = [l.split()[0] for l in f if l.strip() != '']
+    for lfn, pfn in zip(lfns, cp.lfn2pfn(lfns, sys.argv[2])):
+        if pfn is None: print("!!! No rule for", lfn, file=sys.stderr)
+        else: print(pfn)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+## Job status of crab task directories, read from the status cache lines of crab.log
+## Only the bytes appended since the last read are parsed. The summaries are kept per task with the
+## inode, size and parsed offset of the log, in a small JSON cache shared between the crabmon runs.
+import os, sys, ast, json, threading
+
+statusMarker = b'Got information from status cache file'
+
+def parse_status_line(line):
+    ## {jobIdx: {'State':...}, ...} from a DEBUG line of crab.log, None if it cannot be parsed
+    line = line.decode('utf-8', 'replace').strip()
+    if not line.startswith('DEBUG'): return None
+    try:
+        jobstatus = ast.literal_eval('{'+line.split('{', 1)[-1].strip())
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+    return jobstatus if isinstance(jobstatus, dict) else None
+
+def summarize(jobstatus):
+    nSuccess, nFail = 0, 0
+    for jobIdx, status in jobstatus.items():
+        state = status.get('State') if isinstance(status, dict) else None
+        if state == 'finished': nSuccess += 1
+        elif state == 'failed': nFail += 1
+    return [nSuccess, nFail, len(jobstatus)]
+
+class CrabStatusIndex:
+    def __init__(self, cacheFile=None):
+        self.cacheFile = cacheFile
+        self.lock = threading.Lock()
+        self.entries = {} ## dirName: {"inode", "size", "offset", "status":[nSuccess, nFail, nTotal]}
+        self.dirty = False
+        self.nParsed, self.nBytes = 0, 0
+        if cacheFile is not None and os.path.exists(cacheFile):
+            try:
+                with open(cacheFile) as f: self.entries = json.load(f)
+            except ValueError:
+                self.entries = {}
+
+    def status(self, dirName):
+        ## (nSuccess, nFail, nTotal), (-1,-1,-1) if crab.log has no status yet
+        fName = os.path.join(dirName, "crab.log")
+        try:
+            st = os.stat(fName)
+        except OSError:
+            return (-1, -1, -1)
+        with self.lock:
+            entry = self.entries.get(dirName)
+            if entry is None or entry['inode'] != st.st_ino or st.st_size < entry['size']:
+                ## New, rotated or truncated log
+                entry = {'inode':st.st_ino, 'size':0, 'offset':0, 'status':[-1, -1, -1]}
+            if st.st_size != entry['size']:
+                self.update(fName, entry, st.st_size)
+                self.entries[dirName] = entry
+                self.dirty = True
+            return tuple(entry['status'])
+
+    def update(self, fName, entry, size):
+        ## Parse from the last complete line read before. A partly written last line is read again next time
+        with open(fName, "rb") as f:
+            f.seek(entry['offset'])
+            data = f.read(size-entry['offset'])
+        end = data.rfind(b'\n')+1
+        lastLine = None
+        pos = data.rfind(statusMarker, 0, end)
+        while pos >= 0:
+            lineBegin = data.rfind(b'\n', 0, pos)+1
+            jobstatus = parse_status_line(data[lineBegin:data.find(b'\n', pos)])
+            if jobstatus is not None:
+                lastLine = jobstatus
+                break
+            pos = data.rfind(statusMarker, 0, lineBegin)
+        if lastLine is not None and len(lastLine) > 0:
+            entry['status'] = summarize(lastLine)
+            self.nParsed += 1
+        self.nBytes += end
+        entry['offset'] += end
+        entry['size'] = entry['offset']
+
+    def forget(self, dirName):
+        with self.lock:
+            if self.entries.pop(dirName, None) is not None: self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if self.cacheFile is None or not self.dirty: return
+            with open(self.cacheFile+".tmp", "w") as f: json.dump(self.entries, f)
+            os.replace(self.cacheFile+".tmp", self.cacheFile)
+            self.dirty = False
+
+if __name__ == '__main__':
+    index = CrabStatusIndex(".crabmon_status.json")
+    for d in sys.argv[1:] if len(sys.argv) > 1 else sorted(x for x in os.listdir(".") if x.startswith("crab_")):
+        print("%s %d/%d/%d" % ((d,)+index.status(d)))
+    index.save()
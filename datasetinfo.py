@@ -1,24 +1,84 @@
 #!/usr/bin/env python3
 import sys
 import os
-from dbs.apis.dbsClient import DbsApi
+import json, time, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from dbs.apis.dbsClient import DbsApi
+except ImportError:
+    DbsApi = None
 from optparse import OptionParser
 from dataclasses import dataclass, field
 import os
 
+## Per-dataset file metadata kept in the cache, one JSON line per file after a header line
+fileKeys = ["logical_file_name", "file_size", "adler32", "event_count"]
+
 @dataclass
 class DatasetInfo:
     datasetname:list
     verbose:bool
     instance:str = "phys03"
     dataset_fileinfo:dict[str] = field( default_factory=dict)
+    nParallel:int = 4
+    cacheDir:str = os.path.expanduser("~/.cache/datasetinfo")
+    ttl:float = 24*3600
+    refresh:bool = False
+    dbs:object = None ## DBS client with listFiles(dataset=, detail=1), DbsApi by default
+    def getClient(self):
+        if self.dbs is None:
+            if DbsApi is None:
+                print("Cannot import DbsApi. Please, set up the CMS environment (cmsenv or crab).")
+                sys.exit(-1)
+            self.dbs = DbsApi(f'https://cmsweb.cern.ch/dbs/prod/{self.instance}/DBSReader')
+        return self.dbs
+    def cacheFile(self, dataset):
+        key = hashlib.sha1(f"{self.instance}:{dataset}".encode()).hexdigest()
+        return os.path.join(self.cacheDir, f"{key}.json")
+    def isCached(self, dataset):
+        if self.refresh or self.cacheDir is None: return False
+        fileName = self.cacheFile(dataset)
+        return os.path.exists(fileName) and time.time()-os.path.getmtime(fileName) < self.ttl
+    def fetchFiles(self, dataset):
+        files = self.getClient().listFiles(dataset = dataset, detail=1)
+        files = [dict((k, f.get(k)) for k in fileKeys) for f in files]
+        if(self.verbose):
+            print(f"{dataset} : {len(files)} files from DBS")
+        return files
+    def queryDataset(self, dataset):
+        ## Query DBS and replace the cache of the dataset. Nothing is returned, the files are read back
+        ## from the cache so that only the queries running keep their list in memory
+        files = self.fetchFiles(dataset)
+        os.makedirs(self.cacheDir, exist_ok=True)
+        fileName = self.cacheFile(dataset)
+        with open(fileName+f".{threading.get_ident()}.tmp", "w") as f:
+            f.write(json.dumps({"dataset":dataset, "instance":self.instance, "time":time.time(), "nFiles":len(files)})+"\n")
+            for fileinfo in files: f.write(json.dumps([fileinfo[k] for k in fileKeys])+"\n")
+        os.replace(fileName+f".{threading.get_ident()}.tmp", fileName)
+    def iterFiles(self, dataset):
+        ## Files of a dataset updated by updateCache, queried here when there is no cache
+        if self.cacheDir is None: return iter(self.fetchFiles(dataset))
+        return self.iterCachedFiles(dataset)
+    def iterCachedFiles(self, dataset):
+        with open(self.cacheFile(dataset)) as f:
+            f.readline()
+            for l in f:
+                yield dict(zip(fileKeys, json.loads(l)))
+    def updateCache(self):
+        ## Query the datasets missing or expired in the cache, nParallel at a time. Return the list of the datasets
+        datasets = [x.strip() for x in self.datasetname if x.strip() != ""]
+        if self.cacheDir is None: return datasets
+        stale = [x for x in datasets if not self.isCached(x)]
+        if(self.verbose):
+            print(f"{len(datasets)-len(stale)} datasets from the cache, {len(stale)} datasets to query")
+        with ThreadPoolExecutor(max_workers=self.nParallel) as pool:
+            for _ in pool.map(self.queryDataset, stale): pass
+        return datasets
     def getFileListFromDBS3(self):
-        dbs = DbsApi(f'https://cmsweb.cern.ch/dbs/prod/{self.instance}/DBSReader')
-        for dataset in self.datasetname:
-            dataset=dataset.strip()
-            if(self.verbose): 
+        for dataset in self.updateCache():
+            if(self.verbose):
                 print(dataset)
-            self.dataset_fileinfo[dataset] = dbs.listFiles(dataset = dataset, detail=1)
+            self.dataset_fileinfo[dataset] = list(self.iterFiles(dataset))
         return(self.dataset_fileinfo)
     def getFileList(self):
         return(self.dataset_fileinfo)
@@ -37,22 +97,41 @@ class DatasetInfo:
             for fileinfo in self.dataset_fileinfo[dataset]:
                 fileinfo_format.append([fileinfo["logical_file_name"],fileinfo["file_size"],fileinfo["adler32"]])
         return(fileinfo_format)
+    def iterFileListWithFormat(self,want_dataset=None):
+        ## Same records as getFileListWithFormat, read from the cache one file at a time
+        for dataset in self.updateCache():
+            if ( want_dataset is not None and dataset != want_dataset): continue
+            for fileinfo in self.iterFiles(dataset):
+                yield [fileinfo["logical_file_name"],fileinfo["file_size"],fileinfo["adler32"]]
+    def writeFileListWithFormat(self,fout,want_dataset=None,fmt="{lfn} {size} {adler32}\n"):
+        nFiles = 0
+        for lfn, size, checksum in self.iterFileListWithFormat(want_dataset):
+            fout.write(fmt.format(lfn=lfn, size=size, adler32=checksum))
+            nFiles += 1
+        return nFiles
 
 if __name__ == "__main__":
     usage=f"Usage: {sys.argv[0]} [options] [dataset1] [dataset2] ..."
     parser = OptionParser(usage)
     parser.add_option("-f", "--datasetfile", dest="dataset", help="Dataset list file. If this option is set, arguments is ignored.")
     parser.add_option("-i", "--instance", dest="instance",default="phys03", help="Instance Name [global or phys03(default)]")
+    parser.add_option("-o", "--output", dest="output", help="Write \"LFN size adler32\" lines to the file")
+    parser.add_option("-p", "--parallel", dest="nParallel",type="int",default=4, help="Number of DBS queries run simultaneously (default 4)")
+    parser.add_option("--cacheDir", dest="cacheDir",default=os.path.expanduser("~/.cache/datasetinfo"), help="Cache directory (default ~/.cache/datasetinfo)")
+    parser.add_option("--ttl", dest="ttl",type="float",default=24, help="Lifetime of the cache in hours (default 24)")
+    parser.add_option("--refresh", dest="refresh",action="store_true",default=False, help="Query DBS ignoring the cache")
     parser.add_option("-v", "--verbose", dest="verbose",action="store_true", help="Verbose mode")
     (options, args) = parser.parse_args()
     if ( options.dataset is not None):
         datasetname = open(options.dataset).readlines()
     else:
         datasetname = args
-    ds = DatasetInfo(datasetname=datasetname, verbose=options.verbose, instance=options.instance)
-    ds.getFileListFromDBS3()
-    filesinfo = ds.getFileListWithFormat()
-    for fileinfo in filesinfo:
-        lfn, size, checksum = fileinfo
+    ds = DatasetInfo(datasetname=datasetname, verbose=options.verbose, instance=options.instance, nParallel=options.nParallel,
+                     cacheDir=options.cacheDir, ttl=options.ttl*3600, refresh=options.refresh)
+    if ( options.output is not None):
+        with open(options.output, "w") as fout:
+            nFiles = ds.writeFileListWithFormat(fout)
+        print(f"{nFiles} files are written to {options.output}")
+        sys.exit(0)
+    for lfn, size, checksum in ds.iterFileListWithFormat():
         print(f"LFN : {lfn} / Size: {size} / Adler32: {checksum}\n")
-
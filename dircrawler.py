@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+## Parallel walk of a storage namespace with a persistent index of the listings
+##   index file: {"storages": {storage: {dir: {"mtime":MTIME, "files":{name:[size, mtime]}, "dirs":{name:mtime}}}}}
+## with the storage given by the lister (root://host//base or the local prefix), so runs on different storages
+## do not share entries. In the incremental mode the top directory is stat'ed and listed again only if its
+## mtime changed. The subdirectories of a directory taken from the index are trusted with the mtimes of that
+## listing (no stat per directory), those of a directory listed again are compared to the new listing.
+import os, sys, json, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dirlisting import DirEntry, PosixLister, XRootDLister
+
+class StubLister:
+    ## In-memory namespace, {dir: [DirEntry]}, for tests
+    def __init__(self, tree, mtimes={}):
+        self.tree = tree
+        self.mtimes = mtimes
+        self.nScan, self.nStat = 0, 0
+
+    def scan(self, dirName):
+        self.nScan += 1
+        return self.tree.get(dirName)
+
+    def stat(self, dirName):
+        self.nStat += 1
+        if dirName not in self.tree: return None
+        return self.mtimes.get(dirName, 0.)
+
+def lister_key(lister):
+    ## Name of the storage listed by the lister, the key of its entries in the index file
+    if isinstance(lister, XRootDLister): return "root://%s/%s" % (lister.host, lister.basePath)
+    if isinstance(lister, PosixLister): return os.path.abspath(lister.prefix) if lister.prefix else '/'
+    return type(lister).__name__
+
+class DirCrawler:
+    def __init__(self, lister, nParallel=8, indexFile=None, incremental=False, maxDepth=None):
+        ## maxDepth: number of directory levels listed, the top directory being the first (None for no limit)
+        self.lister = lister
+        self.nParallel = nParallel
+        self.indexFile = indexFile
+        self.incremental = incremental
+        self.maxDepth = maxDepth
+        self.storage = lister_key(lister)
+        self.index = {}
+        if indexFile is not None and os.path.exists(indexFile):
+            with open(indexFile) as f: allIndex = json.load(f)
+            ## Older index files are keyed by path only, they are not reused
+            self.index = allIndex.get('storages', {}).get(self.storage, {}) if isinstance(allIndex.get('storages'), dict) else {}
+        self.nListed, self.nCached = 0, 0
+
+    def visit(self, dirName, mtime):
+        ## Return the index record of the directory, listing it only when needed
+        cached = self.index.get(dirName)
+        if mtime is None and self.indexFile is not None:
+            ## Top directory: its mtime is kept in the index for the next incremental run
+            try:
+                mtime = self.lister.stat(dirName)
+            except OSError as e:
+                print(e, file=sys.stderr)
+                if self.incremental and cached is not None: return cached, False
+            else:
+                if mtime is None: return None
+        if self.incremental and cached is not None and cached['mtime'] == mtime:
+            self.nCached += 1
+            return cached, False
+        try:
+            entries = self.lister.scan(dirName)
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return None if cached is None else (cached, False)
+        if entries is None: return None
+        self.nListed += 1
+        record = {'mtime':mtime, 'files':{}, 'dirs':{}}
+        for e in entries:
+            if e.isDir: record['dirs'][e.name] = e.mtime
+            else: record['files'][e.name] = [e.size, e.mtime]
+        return record, True
+
+    def crawl(self, top):
+        ## Walk under top. Return {path: (size, mtime)} of all files
+        top = top.rstrip('/') or '/'
+        begin = time.time()
+        self.nListed, self.nCached = 0, 0
+        files, seen = {}, set()
+        depth = {top:1}
+        with ThreadPoolExecutor(max_workers=self.nParallel) as pool:
+            running = {pool.submit(self.visit, top, None):top}
+            while len(running) > 0:
+                done, notDone = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dirName = running.pop(future)
+                    result = future.result()
+                    if result is None:
+                        self.index.pop(dirName, None)
+                        continue
+                    record, fresh = result
+                    self.index[dirName] = record
+                    seen.add(dirName)
+                    for name, (size, mtime) in record['files'].items():
+                        files[os.path.join(dirName, name)] = (size, mtime)
+                    if self.maxDepth is not None and depth[dirName] >= self.maxDepth: continue
+                    for name, mtime in record['dirs'].items():
+                        ## The mtime in the listing of the parent, fresh or from the index, saves a stat of the subdirectory
+                        subDir = os.path.join(dirName, name)
+                        depth[subDir] = depth[dirName]+1
+                        running[pool.submit(self.visit, subDir, mtime)] = subDir
+        ## Forget the directories removed under top
+        for dirName in list(self.index.keys()):
+            if (dirName == top or dirName.startswith(top.rstrip('/')+'/')) and dirName not in seen:
+                if self.maxDepth is not None and dirName.count('/')-top.count('/') >= self.maxDepth: continue
+                del self.index[dirName]
+        self.elapsed = time.time()-begin
+        return files
+
+    def save(self):
+        if self.indexFile is None: return
+        allIndex = {}
+        if os.path.exists(self.indexFile):
+            with open(self.indexFile) as f: allIndex = json.load(f)
+        if not isinstance(allIndex.get('storages'), dict): allIndex = {'storages':{}}
+        allIndex['storages'][self.storage] = self.index
+        with open(self.indexFile+".tmp", "w") as f: json.dump(allIndex, f)
+        os.replace(self.indexFile+".tmp", self.indexFile)
+
+    def summary(self):
+        return "@@ %d directories listed, %d from the index, %.1f s" % (self.nListed, self.nCached, self.elapsed)
+
+def make_lister(prefix):
+    ## A local directory, or host[:port][//base] of an xrootd server
+    if prefix == '' or os.path.isdir(prefix): return PosixLister(prefix)
+    return XRootDLister(prefix)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: %s PREFIX DIR [INDEX]\nPrint the files under DIR, PREFIX is a local path or host:port//base" % sys.argv[0])
+        sys.exit(1)
+    crawler = DirCrawler(make_lister(sys.argv[1]), indexFile=sys.argv[3] if len(sys.argv) > 3 else None, incremental=len(sys.argv) > 3)
+    for path, (size, mtime) in sorted(crawler.crawl(sys.argv[2]).items()):
+        print(size, path)
+    crawler.save()
+    print(crawler.summary(), file=sys.stderr)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+## Directory listings of a storage, one listing per directory, and the transfer plan made from them
+##   PosixLister  : local or FUSE mounted path (ex. /xrootd)
+##   XRootDLister : "xrdfs HOST ls -l", the prefix is given as "host:port//path" like CMSProtocolInfo
+import os, sys, re, time, threading, subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+FileEntry = namedtuple('FileEntry', 'size checksum')
+DirEntry = namedtuple('DirEntry', 'name isDir size mtime')
+
+def parse_time(value):
+    try:
+        return time.mktime(time.strptime(value, "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        return 0.
+
+class PosixLister:
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+
+    def scan(self, dirName):
+        ## [DirEntry] of the directory, None if the directory does not exist
+        try:
+            entries = []
+            with os.scandir(self.prefix+dirName) as it:
+                for e in it:
+                    st = e.stat()
+                    entries.append(DirEntry(e.name, e.is_dir(), st.st_size, st.st_mtime))
+            return entries
+        except FileNotFoundError:
+            return None
+
+    def stat(self, dirName):
+        ## mtime of the directory, None if it does not exist
+        try:
+            return os.stat(self.prefix+dirName).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def listdir(self, dirName):
+        ## {name: FileEntry} of the files in the directory, None if the directory does not exist
+        entries = self.scan(dirName)
+        if entries is None: return None
+        return dict((e.name, FileEntry(e.size, None)) for e in entries if not e.isDir)
+
+    def checksum(self, fileName):
+        return None
+
+class XRootDLister:
+    def __init__(self, prefix, timeout=300):
+        self.host = prefix.split('/')[0]
+        self.basePath = '/'+prefix[len(self.host):].strip('/')
+        if self.basePath == '/': self.basePath = ''
+        self.timeout = timeout
+
+    def xrdfs(self, *args):
+        try:
+            p = subprocess.run(['xrdfs', self.host]+list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            return -1, '', 'timeout'
+        return p.returncode, p.stdout, p.stderr
+
+    def missing(self, err):
+        return 'no such file' in err.lower() or 'not found' in err.lower()
+
+    def scan(self, dirName):
+        ret, out, err = self.xrdfs('ls', '-l', self.basePath+dirName)
+        if ret != 0:
+            if self.missing(err): return None
+            raise OSError("xrdfs ls failed for %s: %s" % (dirName, err.strip()))
+        entries = []
+        for l in out.splitlines():
+            l = l.split()
+            if len(l) < 5: continue
+            ## "flags date time size path" (xrootd 4) or "flags owner group size date time path" (xrootd 5)
+            if l[-2].isdigit(): size, date = l[-2], l[-4:-2]
+            else: size, date = l[-4], l[-3:-1]
+            entries.append(DirEntry(os.path.basename(l[-1]), l[0].startswith('d'), int(size), parse_time(' '.join(date))))
+        return entries
+
+    def stat(self, dirName):
+        ret, out, err = self.xrdfs('stat', self.basePath+dirName)
+        if ret != 0:
+            if self.missing(err): return None
+            raise OSError("xrdfs stat failed for %s: %s" % (dirName, err.strip()))
+        m = re.search(r'MTime:\s*(\S+ \S+)', out)
+        return parse_time(m.group(1)) if m else None
+
+    def listdir(self, dirName):
+        entries = self.scan(dirName)
+        if entries is None: return None
+        return dict((e.name, FileEntry(e.size, None)) for e in entries if not e.isDir)
+
+    def checksum(self, fileName):
+        ret, out, err = self.xrdfs('query', 'checksum', self.basePath+fileName)
+        l = out.split()
+        if ret != 0 or len(l) < 2 or l[0] != 'adler32': return None
+        return l[1].lower().zfill(8)
+
+class DirectoryIndex:
+    ## Lists each directory once, in parallel, and keeps the listings in memory
+    def __init__(self, lister, nParallel=8):
+        self.lister = lister
+        self.nParallel = nParallel
+        self.dirs = {}
+        self.lock = threading.Lock()
+
+    def listdir(self, dirName):
+        with self.lock:
+            if dirName in self.dirs: return self.dirs[dirName]
+        for attempt in range(2):
+            try:
+                entries = self.lister.listdir(dirName)
+                break
+            except OSError as e:
+                print(e)
+                entries = None
+        with self.lock: self.dirs[dirName] = entries
+        return entries
+
+    def prefetch(self, lfns):
+        dirNames = sorted(set(os.path.dirname(lfn) for lfn in lfns) - set(self.dirs.keys()))
+        with ThreadPoolExecutor(max_workers=self.nParallel) as pool:
+            list(pool.map(self.listdir, dirNames))
+        return len(dirNames)
+
+    def stat(self, lfn):
+        entries = self.listdir(os.path.dirname(lfn))
+        if entries is None: return None
+        return entries.get(os.path.basename(lfn))
+
+    def checksums(self, lfns):
+        with ThreadPoolExecutor(max_workers=self.nParallel) as pool:
+            return dict(zip(lfns, pool.map(self.lister.checksum, lfns)))
+
+class TransferPlan:
+    def __init__(self):
+        self.copy = []    ## (lfn, size, reason)
+        self.skip = []    ## (lfn, size)
+        self.missing = [] ## not in the source
+        self.nDirs = 0
+        self.elapsed = 0.
+
+    def summary(self):
+        return "@@ Transfer plan: %d to copy (%.1f GB), %d already at the destination, %d missing at the source. Planned in %.1f s (%d directories)" % (
+               len(self.copy), sum(max(0, x[1] or 0) for x in self.copy)/1e9, len(self.skip), len(self.missing), self.elapsed, self.nDirs)
+
+    def write(self, fileName):
+        with open(fileName, "w") as f:
+            for lfn, size, reason in self.copy: f.write("COPY %s %s %s\n" % (lfn, -1 if size is None else size, reason))
+            for lfn, size in self.skip: f.write("SKIP %s %s same\n" % (lfn, size))
+            for lfn in self.missing: f.write("MISSING %s -1 nosource\n" % lfn)
+
+def make_plan(lfns, source, dest, force=False, checksum=False):
+    ## source: DirectoryIndex, or {lfn: size} when the sizes are known from the file list (size < 0 if unknown)
+    ## dest  : DirectoryIndex. A file is copied if it is missing at the destination or differs in size or adler32
+    begin = time.time()
+    plan = TransferPlan()
+    indices = [dest] + ([source] if isinstance(source, DirectoryIndex) else [])
+    with ThreadPoolExecutor(max_workers=len(indices)) as pool:
+        plan.nDirs = sum(pool.map(lambda x: x.prefetch(lfns), indices))
+
+    same = []
+    for lfn in lfns:
+        if isinstance(source, DirectoryIndex):
+            src = source.stat(lfn)
+            if src is None:
+                plan.missing.append(lfn)
+                continue
+            srcSize = src.size
+        else:
+            srcSize = int(source.get(lfn, -1))
+            if srcSize < 0: srcSize = None
+        dst = dest.stat(lfn)
+        if force: plan.copy.append((lfn, srcSize, 'force'))
+        elif dst is None: plan.copy.append((lfn, srcSize, 'missing'))
+        elif srcSize is None: plan.copy.append((lfn, srcSize, 'nosize'))
+        elif dst.size != srcSize: plan.copy.append((lfn, srcSize, 'size'))
+        else: same.append((lfn, srcSize))
+
+    if checksum and len(same) > 0 and isinstance(source, DirectoryIndex):
+        ## adler32 only for the files with the same size, where the listing cannot tell
+        names = [x[0] for x in same]
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            srcSums, dstSums = pool.map(lambda x: x.checksums(names), (source, dest))
+        for lfn, size in same:
+            if None not in (srcSums[lfn], dstSums[lfn]) and srcSums[lfn] != dstSums[lfn]:
+                plan.copy.append((lfn, size, 'adler32'))
+            else:
+                plan.skip.append((lfn, size))
+    else:
+        plan.skip = same
+    plan.elapsed = time.time()-begin
+    return plan
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: %s PREFIX LISTFILE\nList the directories of the LFNs in LISTFILE under PREFIX (a local path or host:port//path)" % sys.argv[0])
+        sys.exit(1)
+    lister = PosixLister(sys.argv[1]) if os.path.isdir(sys.argv[1]) else XRootDLister(sys.argv[1])
+    index = DirectoryIndex(lister)
+    lfns = [l.split()[0] for l in open(sys.argv[2]) if l.strip() != '']
+    begin = time.time()
+    nDirs = index.prefetch(lfns)
+    found = sum(1 for lfn in lfns if index.stat(lfn) is not None)
+    print("%d/%d files found in %d directories, %.1f s" % (found, len(lfns), nDirs, time.time()-begin))
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+## Merge plan of ROOT files: a tree reduction built from the file sizes
+##   - the inputs are split in contiguous groups not exceeding maxSize, one output file per group
+##   - a group with more than fanIn files is merged through intermediate files, level by level
+## The nodes run on at most nProc merge processes as soon as their inputs are ready. The state is kept in
+## OUTPUT.haddplan.json, so a failed merge can be resumed without redoing the finished nodes.
+import os, sys, re, json, time, heapq, shlex, hashlib, subprocess
+from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+def split_by_max(items, maxSize):
+    ## Contiguous groups with total size up to maxSize, a file larger than maxSize goes alone
+    groups, acc = [[]], 0
+    for item in items:
+        if len(groups[-1]) > 0 and acc+item[1] > maxSize:
+            groups.append([])
+            acc = 0
+        groups[-1].append(item)
+        acc += item[1]
+    return groups
+
+def split_by_count(items, fanIn):
+    ## ceil(n/fanIn) groups of at most fanIn files with similar total sizes, largest file first to the lightest group
+    nGroup = (len(items)+fanIn-1)//fanIn
+    heap = [(0, i) for i in range(nGroup)]
+    groups = [[] for i in range(nGroup)]
+    for idx in sorted(range(len(items)), key=lambda x: -items[x][1]):
+        full = []
+        load, i = heapq.heappop(heap)
+        while len(groups[i]) >= fanIn:
+            full.append((load, i))
+            load, i = heapq.heappop(heap)
+        groups[i].append(idx)
+        heapq.heappush(heap, (load+items[idx][1], i))
+        for x in full: heapq.heappush(heap, x)
+    return [[items[idx] for idx in sorted(g)] for g in groups]
+
+class MergePlan:
+    def __init__(self, inputs, output, fanIn=25, maxSize=None, workDir=None):
+        ## inputs: [(path, size)]. Outputs are OUTPUT_N.root if maxSize is set, OUTPUT otherwise
+        self.nodes = [] ## {"name", "inputs", "output", "size", "final"}
+        self.inputs = [list(x) for x in inputs]
+        prefix = output[:-5] if output.endswith('.root') else output
+        self.workDir = workDir if workDir is not None else os.path.dirname(os.path.abspath(output))
+        tmpBase = os.path.join(self.workDir, os.path.basename(prefix))
+
+        groups = [list(inputs)]
+        if maxSize is not None: groups = split_by_max(list(inputs), maxSize)
+        for iGroup, items in enumerate(groups):
+            finalName = "%s_%d.root" % (prefix, iGroup) if maxSize is not None else output
+            level = 0
+            while len(items) > fanIn:
+                merged = []
+                for i, sub in enumerate(split_by_count(items, fanIn)):
+                    node = self.add("%s__g%d_l%d_%d.root" % (tmpBase, iGroup, level, i), sub, False)
+                    merged.append((node['output'], node['size']))
+                items = merged
+                level += 1
+            self.add(finalName, items, True)
+
+    def add(self, output, items, final):
+        node = {'name':os.path.basename(output), 'inputs':[x[0] for x in items], 'output':output,
+                'size':sum(x[1] for x in items), 'final':final}
+        self.nodes.append(node)
+        return node
+
+    def key(self):
+        return hashlib.sha1(json.dumps(self.nodes, sort_keys=True).encode()).hexdigest()
+
+    def summary(self):
+        finals = [x for x in self.nodes if x['final']]
+        return "@@ Merge plan: %d outputs, %d merge steps (%d intermediate), largest output %.2f GB" % (
+               len(finals), len(self.nodes), len(self.nodes)-len(finals), max(x['size'] for x in finals)/1e9)
+
+class MergeRunner:
+    def __init__(self, plan, mergeCmd="hadd -f {output} {inputs}", nProc=None, stateFile=None, verbose=False):
+        self.plan = plan
+        self.mergeCmd = mergeCmd
+        self.nProc = nProc if nProc is not None else (os.cpu_count() or 1)
+        self.stateFile = stateFile
+        self.verbose = verbose
+        self.done = set()
+        if stateFile is not None and os.path.exists(stateFile):
+            with open(stateFile) as f: state = json.load(f)
+            if state.get('key') == plan.key():
+                self.done = set(x for x in state['done'] if os.path.exists(self.node(x)['output']))
+                print("@@ Resume: %d of %d merge steps are already done" % (len(self.done), len(plan.nodes)))
+
+    def node(self, name):
+        return [x for x in self.plan.nodes if x['name'] == name][0]
+
+    def saveState(self):
+        if self.stateFile is None: return
+        with open(self.stateFile+".tmp", "w") as f:
+            json.dump({'key':self.plan.key(), 'done':sorted(self.done), 'nodes':self.plan.nodes, 'inputs':self.plan.inputs}, f)
+        os.replace(self.stateFile+".tmp", self.stateFile)
+
+    def merge(self, node):
+        ## Merge into a temporary file, renamed only on success so a partial output is never taken as done
+        tmpName = node['output'][:-5]+".part.root" if node['output'].endswith('.root') else node['output']+".part"
+        cmd = self.mergeCmd.format(output=shlex.quote(tmpName), inputs=' '.join(shlex.quote(x) for x in node['inputs']))
+        if self.verbose: print(cmd)
+        begin = time.time()
+        out = None if self.verbose else subprocess.DEVNULL
+        ret = subprocess.call(cmd, shell=True, stdout=out)
+        if ret != 0 or not os.path.exists(tmpName):
+            if os.path.exists(tmpName): os.remove(tmpName)
+            return False, time.time()-begin
+        os.replace(tmpName, node['output'])
+        return True, time.time()-begin
+
+    def run(self):
+        ## Return the list of the failed merge steps
+        producer = dict((x['output'], x['name']) for x in self.plan.nodes)
+        deps = dict((x['name'], set(producer[i] for i in x['inputs'] if i in producer)) for x in self.plan.nodes)
+        pending = [x for x in self.plan.nodes if x['name'] not in self.done]
+        failed, blocked = [], set()
+        begin = time.time()
+        with ThreadPoolExecutor(max_workers=self.nProc) as pool:
+            running = {}
+            while True:
+                for node in pending[:]:
+                    if node['name'] in blocked:
+                        pending.remove(node)
+                    elif deps[node['name']] <= self.done:
+                        pending.remove(node)
+                        running[pool.submit(self.merge, node)] = node
+                if len(running) == 0: break
+                finished, notDone = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    node = running.pop(future)
+                    ok, elapsed = future.result()
+                    if ok:
+                        self.done.add(node['name'])
+                        self.saveState()
+                        print("@@ %s: %d files, %.2f GB, %.1f s (%d/%d)" % (node['name'], len(node['inputs']), node['size']/1e9,
+                              elapsed, len(self.done), len(self.plan.nodes)))
+                    else:
+                        print("!!! Merge failed: %s" % node['name'])
+                        failed.append(node['name'])
+                        ## The steps depending on it cannot run, the others go on
+                        blocked.update(self.descendants(node['name'], deps))
+        print("@@ Merge finished in %.1f s, %d failed, %d not run" % (time.time()-begin, len(failed), len(blocked)))
+        return failed
+
+    def descendants(self, name, deps):
+        result, added = set(), set([name])
+        while len(added) > 0:
+            added = set(x for x, d in deps.items() if d & (added | result) and x not in result) - result
+            result |= added
+        return result
+
+    def cleanup(self, deleteInputs=False):
+        ## Called after a complete success: remove the intermediate files, and the inputs if asked
+        outputs = set(x['output'] for x in self.plan.nodes if x['final'])
+        intermediates = set(x['output'] for x in self.plan.nodes if not x['final'])
+        for node in self.plan.nodes:
+            for fileName in node['inputs']:
+                if fileName in outputs: continue
+                if (fileName in intermediates or deleteInputs) and os.path.exists(fileName): os.remove(fileName)
+        if self.stateFile is not None and os.path.exists(self.stateFile): os.remove(self.stateFile)
+
+def is_work_file(fileName):
+    ## Intermediate (OUTPUT__gN_lN_N.root) or partial (.part.root) files of a merge plan
+    return re.search(r'__g\d+_l\d+_\d+\.root$', fileName) is not None or fileName.endswith('.part.root')
+
+def state_inputs(stateFile):
+    ## [(path, size)] of the inputs of an unfinished merge, None if there is none
+    if not os.path.exists(stateFile): return None
+    with open(stateFile) as f: state = json.load(f)
+    if 'inputs' in state: return [tuple(x) for x in state['inputs']]
+    ## Older state files: the inputs are the files not produced by a node
+    outputs = set(x['output'] for x in state['nodes'])
+    return [(x, os.stat(x).st_size) for node in state['nodes'] for x in node['inputs'] if x not in outputs]
+
+def main(argv, fanIn=25, maxSize=None, mergeCmd="hadd -f {output} {inputs}", delete=False):
+    parser = OptionParser("Usage: %prog [options] OUTPUT.root INPUT_0.root INPUT_1.root ...")
+    parser.add_option("-j", "--nProc", dest="nProc", type="int", default=os.cpu_count(), help="Number of merge processes (default: number of cores)")
+    parser.add_option("--fanIn", dest="fanIn", type="int", default=fanIn, help="Maximum number of files per merge (default %d)" % fanIn)
+    parser.add_option("--maxSize", dest="maxSize", type="float", default=None if maxSize is None else maxSize/1e9,
+                      help="Split the output in OUTPUT_N.root of at most this size in GB%s" % ("" if maxSize is None else " (default %g)" % (maxSize/1e9)))
+    parser.add_option("--mergeCmd", dest="mergeCmd", default=mergeCmd, help="Merge command with {output} and {inputs} (default \"%s\")" % mergeCmd)
+    parser.add_option("--delete", dest="delete", action="store_true", default=delete, help="Delete the inputs after a successful merge")
+    parser.add_option("--keep", dest="delete", action="store_false", help="Keep the inputs")
+    parser.add_option("-n", "--dryRun", dest="dryRun", action="store_true", default=False, help="Print the merge plan only")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true", default=False, help="Print the merge commands")
+    (options, args) = parser.parse_args(argv)
+    if len(args) < 2:
+        parser.print_help()
+        return 1
+    output, inFileNames = args[0], args[1:]
+    if options.fanIn < 2:
+        print("--fanIn should be larger than 1")
+        return 1
+
+    ## A rerun with OUTPUT*.root or *.root also matches the files of the unfinished merge: they are never inputs
+    workFiles = [x for x in inFileNames if is_work_file(x)]
+    if len(workFiles) > 0:
+        print("@@ %d intermediate merge files among the arguments are ignored" % len(workFiles))
+    stateFile = output+".haddplan.json"
+    inputs = state_inputs(stateFile)
+    if inputs is not None:
+        print("@@ Resume with the %d inputs recorded in %s" % (len(inputs), stateFile))
+    else:
+        inputs = [(x, os.stat(x).st_size) for x in inFileNames if x != output and not is_work_file(x)]
+    plan = MergePlan(inputs, output,
+                     fanIn=options.fanIn, maxSize=None if options.maxSize is None else options.maxSize*1e9)
+    print(plan.summary())
+    if options.dryRun:
+        for node in plan.nodes: print(node['output'], len(node['inputs']), "%.2f GB" % (node['size']/1e9))
+        return 0
+    runner = MergeRunner(plan, options.mergeCmd, options.nProc, stateFile, options.verbose)
+    if len(runner.run()) > 0:
+        print("Merge is not complete. Inputs and finished merges are kept, run the same command again to resume")
+        return 2
+    runner.cleanup(options.delete)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
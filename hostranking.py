@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+## Ranking of the worker nodes from the outputs of the probe jobs of condorSubmitProbeJobs
+## Each probe writes KEY=VALUE lines (HOST, WRITE_MBPS, READ_MBPS, CVMFS_MS, UNTAR_S) and FAIL lines.
+## A host is FAIL if any probe failed on it, SLOW if one of its medians is worse than slowFactor times
+## the median of all hosts, OK otherwise. The table is read by create-batch3 --hostRanking.
+import sys, os, re
+
+metrics = [('WRITE_MBPS', True), ('READ_MBPS', True), ('CVMFS_MS', False), ('UNTAR_S', False)] ## (name, higher is better)
+
+def parse_probe(fileName):
+    ## {'HOST':..., metric:value, 'FAIL':[messages]}
+    out = {'FAIL':[]}
+    with open(fileName, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('FAIL'):
+                out['FAIL'].append(line)
+                continue
+            m = re.match(r'^([A-Z_0-9]+)=(.*)$', line)
+            if m is None: continue
+            key, value = m.group(1), m.group(2).strip('"')
+            if key == 'HOST': out['HOST'] = value
+            elif key in dict(metrics):
+                try: out[key] = float(value)
+                except ValueError: out['FAIL'].append("FAIL %s=%s" % (key, value))
+    return out
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if n == 0: return None
+    return values[n//2] if n%2 == 1 else 0.5*(values[n//2-1]+values[n//2])
+
+def rank(probes, slowFactor=2.):
+    ## [{'host', 'nProbe', 'nFail', metric:median, 'score', 'status'}, ...] from the best host to the worst
+    hosts = {}
+    for probe in probes:
+        if 'HOST' not in probe: continue
+        hosts.setdefault(probe['HOST'], []).append(probe)
+    rows = []
+    for host, ps in hosts.items():
+        row = {'host':host, 'nProbe':len(ps), 'nFail':sum(1 for p in ps if len(p['FAIL']) > 0)}
+        for name, _ in metrics: row[name] = median([p[name] for p in ps if name in p])
+        rows.append(row)
+    refs = dict((name, median([r[name] for r in rows if r[name] is not None])) for name, _ in metrics)
+    for row in rows:
+        ## Score: mean of the ratios to the reference, above 1 is worse than the typical host
+        ratios = []
+        for name, higherIsBetter in metrics:
+            if row[name] is None or refs[name] is None or refs[name] <= 0: continue
+            if higherIsBetter: ratios.append(refs[name]/row[name] if row[name] > 0 else float('inf'))
+            else: ratios.append(row[name]/refs[name])
+        row['score'] = sum(ratios)/len(ratios) if len(ratios) > 0 else float('inf')
+        if row['nFail'] > 0 or len(ratios) == 0: row['status'] = 'FAIL'
+        elif max(ratios) > slowFactor: row['status'] = 'SLOW'
+        else: row['status'] = 'OK'
+    rows.sort(key=lambda r: ({'OK':0, 'SLOW':1, 'FAIL':2}[r['status']], r['score']))
+    return rows
+
+def write_table(rows, fout=sys.stdout):
+    print("# %-38s %6s %5s %10s %10s %10s %8s %7s %s" % ("host", "nProbe", "nFail", "write(MB/s)", "read(MB/s)",
+          "cvmfs(ms)", "untar(s)", "score", "status"), file=fout)
+    def fmt(x): return "-" if x is None else "%.4g" % x
+    for r in rows:
+        print("%-40s %6d %5d %10s %10s %10s %8s %7.3g %s" % (r['host'], r['nProbe'], r['nFail'], fmt(r['WRITE_MBPS']),
+              fmt(r['READ_MBPS']), fmt(r['CVMFS_MS']), fmt(r['UNTAR_S']), r['score'], r['status']), file=fout)
+
+def read_table(fileName):
+    ## {host: status}
+    out = {}
+    with open(fileName) as f:
+        for line in f:
+            line = line.strip()
+            if line == '' or line.startswith('#'): continue
+            items = line.split()
+            out[items[0]] = items[-1]
+    return out
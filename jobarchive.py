@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import os, sys, stat, time, json
+import hashlib, tarfile, zlib, shutil, fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+## Same selection as "tar --exclude-vcs --exclude tmp --exclude-tag-all=.create-batch --exclude-tag-all=.requestcache"
+excludeNames = set(['tmp', 'job.tar', 'job.tar.gz', 'cmssw.tar.gz',
+                    'CVS', 'RCS', 'SCCS', '.git', '.gitignore', '.gitattributes', '.gitmodules',
+                    '.cvsignore', '.svn', '.arch-ids', '{arch}', '=RELEASE-ID', '=meta-update', '=update',
+                    '.bzr', '.bzrignore', '.bzrtags', '.hg', '.hgignore', '.hgtags', '_darcs'])
+excludeTags = ('.create-batch', '.requestcache')
+
+def compress_block(block, level):
+    ## Each block is an independent gzip member. "gzip -d" and "tar xz" read concatenated members
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(block) + c.flush()
+
+class ParallelGzipFile:
+    ## Write-only file object compressing fixed size blocks in threads (zlib releases the GIL)
+    def __init__(self, fileName, nThreads=None, blockSize=4*1024*1024, level=6):
+        self.fout = open(fileName, "wb")
+        self.nThreads = nThreads or min(8, os.cpu_count() or 1)
+        self.pool = ThreadPoolExecutor(max_workers=self.nThreads)
+        self.blockSize = blockSize
+        self.level = level
+        self.buffer = bytearray()
+        self.pending = []
+        self.bytesIn = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.bytesIn += len(data)
+        while len(self.buffer) >= self.blockSize:
+            self.submit(bytes(self.buffer[:self.blockSize]))
+            del self.buffer[:self.blockSize]
+        return len(data)
+
+    def submit(self, block):
+        self.pending.append(self.pool.submit(compress_block, block, self.level))
+        ## Keep the memory bounded, write out finished blocks in order
+        while len(self.pending) > 2*self.nThreads:
+            self.fout.write(self.pending.pop(0).result())
+
+    def close(self):
+        if len(self.buffer) > 0: self.submit(bytes(self.buffer))
+        self.buffer = bytearray()
+        for f in self.pending: self.fout.write(f.result())
+        self.pending = []
+        self.pool.shutdown()
+        self.fout.close()
+
+def collect_tree(baseDir, arcBase, keepRoot=('src/*/*/data',), tags=excludeTags):
+    ## List (path, arcname) of the files to be archived, sorted to give a stable digest
+    entries = []
+    for path, dirs, files in os.walk(baseDir):
+        if any(os.path.exists(os.path.join(path, tag)) for tag in tags):
+            dirs[:] = []
+            continue
+        ## os.walk does not follow the symlinks to directories ($CMSSW_BASE/python/Sub/Pkg), they are stored as links
+        linkDirs = [d for d in dirs if d not in excludeNames and os.path.islink(os.path.join(path, d))]
+        dirs[:] = sorted(d for d in dirs if d not in excludeNames and d not in linkDirs)
+        relDir = os.path.relpath(path, baseDir)
+        entries.append((path, os.path.normpath(os.path.join(arcBase, relDir))))
+        for name in sorted(linkDirs):
+            entries.append((os.path.join(path, name), os.path.join(arcBase, os.path.normpath(os.path.join(relDir, name)))))
+        isData = any(fnmatch_path(relDir, x) for x in keepRoot)
+        for name in sorted(files):
+            if name in excludeNames: continue
+            if name.endswith('.root') and not isData: continue
+            relPath = os.path.normpath(os.path.join(relDir, name))
+            entries.append((os.path.join(path, name), os.path.join(arcBase, relPath)))
+    return entries
+
+def fnmatch_path(relDir, pattern):
+    ## True if relDir is the pattern directory or one of its subdirectories
+    nDepth = len(pattern.split('/'))
+    parts = relDir.split(os.sep)
+    return len(parts) >= nDepth and fnmatch.fnmatch('/'.join(parts[:nDepth]), pattern)
+
+def tree_digest(entries):
+    ## Content hash of the tree: names, modes, link targets and file contents
+    h = hashlib.sha1()
+    for path, arcname in entries:
+        st = os.lstat(path)
+        h.update(("%s\0%o\0" % (arcname, st.st_mode)).encode('utf-8', 'surrogateescape'))
+        if stat.S_ISLNK(st.st_mode):
+            h.update(os.readlink(path).encode('utf-8', 'surrogateescape'))
+        elif stat.S_ISREG(st.st_mode):
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024*1024), b''): h.update(block)
+    return h.hexdigest()
+
+def write_tar(fout, entries):
+    ## Minimal tar writer on top of TarInfo, to stream into ParallelGzipFile
+    nBytes = 0
+    for path, arcname in entries:
+        st = os.lstat(path)
+        info = tarfile.TarInfo(arcname)
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.mtime = int(st.st_mtime)
+        info.uid, info.gid = st.st_uid, st.st_gid
+        if stat.S_ISLNK(st.st_mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(path)
+        elif stat.S_ISREG(st.st_mode):
+            info.size = st.st_size
+        elif stat.S_ISDIR(st.st_mode):
+            info.type = tarfile.DIRTYPE
+        else:
+            continue
+        fout.write(info.tobuf(tarfile.GNU_FORMAT, 'utf-8', 'surrogateescape'))
+        if info.isreg():
+            nLeft = info.size
+            with open(path, "rb") as f:
+                while nLeft > 0:
+                    block = f.read(min(nLeft, 1024*1024))
+                    if len(block) == 0: break
+                    fout.write(block)
+                    nLeft -= len(block)
+            if nLeft > 0: fout.write(b'\0'*nLeft) ## File is truncated while reading
+            if info.size % tarfile.BLOCKSIZE != 0:
+                fout.write(b'\0'*(tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE))
+        nBytes += info.size
+    fout.write(b'\0'*(2*tarfile.BLOCKSIZE))
+    return nBytes
+
+class ArchiveCache:
+    ## Compressed archives keyed by the tree digest, shared by create-batch runs.
+    ## Only the nKeep most recently built or reused archives are kept, the workspaces hold hard links or copies
+    def __init__(self, cacheDir, nKeep=3):
+        self.cacheDir = cacheDir
+        self.nKeep = nKeep
+        if not os.path.isdir(cacheDir): os.makedirs(cacheDir)
+
+    def path(self, digest):
+        return os.path.join(self.cacheDir, "%s.tar.gz" % digest)
+
+    def info(self, digest):
+        infoName = os.path.join(self.cacheDir, "%s.json" % digest)
+        if not os.path.exists(self.path(digest)) or not os.path.exists(infoName): return None
+        os.utime(self.path(digest)) ## Recently used, kept by prune()
+        with open(infoName) as f: return json.load(f)
+
+    def build(self, digest, entries, nThreads=None):
+        begin = time.time()
+        tmpName = "%s.%d.tmp" % (self.path(digest), os.getpid())
+        fout = ParallelGzipFile(tmpName, nThreads=nThreads)
+        nBytes = write_tar(fout, entries)
+        fout.close()
+        os.rename(tmpName, self.path(digest))
+        info = {'seconds':time.time()-begin, 'bytes':os.path.getsize(self.path(digest)),
+                'inputBytes':nBytes, 'nFiles':len(entries)}
+        with open(os.path.join(self.cacheDir, "%s.json" % digest), "w") as f: json.dump(info, f)
+        self.prune(keep=digest)
+        return info
+
+    def prune(self, keep=None):
+        ## Remove the archives beyond the nKeep most recent ones, their .json, orphan .json and old temporary files
+        archives, now = [], time.time()
+        for name in os.listdir(self.cacheDir):
+            fileName = os.path.join(self.cacheDir, name)
+            try:
+                if name.endswith('.tar.gz'): archives.append((os.path.getmtime(fileName), name[:-len('.tar.gz')]))
+                elif name.endswith('.tmp') and now-os.path.getmtime(fileName) > 86400: os.remove(fileName)
+                elif name.endswith('.json') and not os.path.exists(self.path(name[:-len('.json')])): os.remove(fileName)
+            except OSError:
+                pass ## Removed by another create-batch
+        archives.sort(reverse=True)
+        for mtime, digest in archives[self.nKeep:]:
+            if digest == keep: continue
+            for fileName in (os.path.join(self.cacheDir, "%s.json" % digest), self.path(digest)):
+                try:
+                    os.remove(fileName)
+                except OSError:
+                    pass
+
+    def link(self, digest, dest):
+        ## Hard link if possible, copy across file systems
+        if os.path.exists(dest): os.remove(dest)
+        try:
+            os.link(self.path(digest), dest)
+            return True
+        except OSError:
+            shutil.copyfile(self.path(digest), dest)
+            return False
+
+if __name__ == '__main__':
+    ## Usage: jobarchive.py CACHE_DIR SOURCE_DIR : print the digest of SOURCE_DIR and its cache status
+    if len(sys.argv) < 3:
+        print("Usage: %s CACHE_DIR SOURCE_DIR" % sys.argv[0])
+        sys.exit(1)
+    srcDir = os.path.abspath(sys.argv[2])
+    digest = tree_digest(collect_tree(srcDir, os.path.basename(srcDir)))
+    print(digest, ArchiveCache(sys.argv[1]).info(digest))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+## Job manifest of create-batch: one file for all job sections
+##   line 1 : fixed width header with the number of sections and the offset of the index
+##   line 2 : JSON record common to all sections (ex. secondaryFileNames)
+##   then   : one JSON record per section
+##   end    : fixed width byte offsets of the section records, so a job reads only its own record
+import os, sys, json
+
+headerFormat = "#create-batch-manifest 1 %010d %015d\n"
+headerSize = len(headerFormat % (0, 0))
+indexFormat = "%015d\n"
+indexSize = len(indexFormat % 0)
+
+class ManifestWriter:
+    def __init__(self, fileName, common={}):
+        self.fileName = fileName
+        self.fout = open(fileName+".tmp", "wb")
+        self.fout.write(b' '*headerSize)
+        self.fout.write((json.dumps(common, separators=(',',':'))+"\n").encode())
+        self.offsets = []
+
+    def add(self, record):
+        self.offsets.append(self.fout.tell())
+        self.fout.write((json.dumps(record, separators=(',',':'))+"\n").encode())
+
+    def close(self):
+        indexOffset = self.fout.tell()
+        self.fout.write(''.join(indexFormat % x for x in self.offsets).encode())
+        self.fout.seek(0)
+        self.fout.write((headerFormat % (len(self.offsets), indexOffset)).encode())
+        self.fout.close()
+        os.replace(self.fileName+".tmp", self.fileName)
+
+def read_header(fin):
+    header = fin.read(headerSize).decode()
+    if not header.startswith("#create-batch-manifest 1 "):
+        raise ValueError("Not a create-batch manifest")
+    nSection, indexOffset = [int(x) for x in header.split()[2:4]]
+    common = json.loads(fin.readline())
+    return nSection, indexOffset, common
+
+def read_section(fileName, section):
+    with open(fileName, "rb") as fin:
+        nSection, indexOffset, common = read_header(fin)
+        if section < 0 or section >= nSection:
+            raise IndexError("Section %d is not in the manifest (%d sections)" % (section, nSection))
+        fin.seek(indexOffset + section*indexSize)
+        fin.seek(int(fin.read(indexSize)))
+        common.update(json.loads(fin.readline()))
+    return common
+
+def read_all(fileName):
+    with open(fileName, "rb") as fin:
+        nSection, indexOffset, common = read_header(fin)
+        records = [json.loads(fin.readline()) for i in range(nSection)]
+    return common, records
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: %s job_manifest.txt [SECTION]" % sys.argv[0])
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        print(json.dumps(read_section(sys.argv[1], int(sys.argv[2])), indent=1))
+    else:
+        common, records = read_all(sys.argv[1])
+        print("%d sections, common entries: %s" % (len(records), ", ".join(common.keys())))
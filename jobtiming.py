@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+## Per-phase timing of the batch jobs of create-batch, shipped in the job workspace
+##   run    : runs the payload, saves its peak RSS, cpu time and I/O
+##   report : builds the record of the section from the phase marks of the run script, prints it
+##            with the "@@ TIMING" marker in the job log and optionally appends it to a file
+## The records are collected from the workspaces by create-batch-timing.
+import os, sys, json, time, socket, resource, subprocess
+
+marker = "@@ TIMING"
+
+def read_io(pid='self'):
+    ## Counters of /proc/PID/io. They include the children already waited for
+    try:
+        with open("/proc/%s/io" % pid) as f:
+            io = dict((k.rstrip(':'), int(v)) for k, v in (l.split() for l in f if ':' in l))
+    except (OSError, ValueError):
+        return {}
+    return {'readBytes':io.get('rchar', 0), 'writeBytes':io.get('wchar', 0),
+            'diskReadBytes':io.get('read_bytes', 0), 'diskWriteBytes':io.get('write_bytes', 0)}
+
+def run(cmd, usageFile=None):
+    begin = time.time()
+    exitCode = subprocess.call(cmd)
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage = {'exitCode':exitCode, 'seconds':round(time.time()-begin, 3),
+             'maxRSS':ru.ru_maxrss, 'user':round(ru.ru_utime, 3), 'sys':round(ru.ru_stime, 3)}
+    usage.update(read_io())
+    if usageFile is not None:
+        with open(usageFile, "w") as f: json.dump(usage, f)
+    return exitCode
+
+def make_record(section, exitCode, marks, usage=None, jobIO=None):
+    ## marks: [(phase, start time), ...] in the order of the script, the last one ends the job
+    phases = {}
+    for (name, start), (_, end) in zip(marks[:-1], marks[1:]):
+        phases[name] = round(phases.get(name, 0)+end-start, 3)
+    record = {'section':section, 'host':socket.gethostname(), 'exitCode':exitCode,
+              'start':marks[0][1] if len(marks) > 0 else None,
+              'total':round(marks[-1][1]-marks[0][1], 3) if len(marks) > 0 else 0,
+              'phases':phases, 'lastPhase':marks[-2][0] if len(marks) > 1 else None}
+    if usage is not None: record['payload'] = usage
+    if jobIO is not None: record['io'] = jobIO
+    return record
+
+def parse_record(line):
+    ## Record from a log line, None for the other lines
+    pos = line.find(marker)
+    if pos < 0: return None
+    try:
+        record = json.loads(line[pos+len(marker):])
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) and 'section' in record else None
+
+def read_records(jobDir):
+    ## {section: record} of a workspace. The last record of a section wins (resubmitted jobs)
+    records = {}
+    fileNames = [os.path.join(jobDir, "timing.log")]
+    fileNames += sorted(os.path.join(jobDir, x) for x in os.listdir(jobDir) if x.startswith("job_") and x.endswith(".log"))
+    for fileName in fileNames:
+        if not os.path.exists(fileName): continue
+        with open(fileName, errors='replace') as f:
+            for line in f:
+                record = parse_record(line)
+                if record is None: continue
+                old = records.get(record['section'])
+                if old is None or (record.get('start') or 0) >= (old.get('start') or 0):
+                    records[record['section']] = record
+    return records
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'run':
+        ## jobtiming.py run [--usage FILE] -- CMD ARGS...
+        args = sys.argv[2:]
+        usageFile = None
+        if len(args) > 1 and args[0] == '--usage': usageFile, args = args[1], args[2:]
+        if len(args) > 0 and args[0] == '--': args = args[1:]
+        if len(args) == 0:
+            print("Usage: %s run [--usage FILE] -- CMD ARGS..." % sys.argv[0])
+            sys.exit(1)
+        sys.exit(run(args, usageFile))
+    elif len(sys.argv) > 1 and sys.argv[1] == 'report':
+        ## jobtiming.py report --section N --exitCode N [--usage FILE] [--append FILE] PHASE=TIME ...
+        from optparse import OptionParser
+        parser = OptionParser("Usage: %prog report --section N --exitCode N [--usage FILE] [--append FILE] PHASE=TIME ...")
+        parser.add_option("--section", dest="section", type="int", default=-1, help="Section number")
+        parser.add_option("--exitCode", dest="exitCode", type="int", default=0, help="Exit code of the job")
+        parser.add_option("--usage", dest="usage", help="Usage file written by the run command, removed after reading")
+        parser.add_option("--append", dest="append", help="Also append the record to this file")
+        (options, args) = parser.parse_args(sys.argv[2:])
+        marks = []
+        for arg in args:
+            name, _, t = arg.partition('=')
+            try: marks.append((name, float(t)))
+            except ValueError: pass
+        marks.append(('end', time.time()))
+        usage = None
+        if options.usage is not None and os.path.exists(options.usage):
+            try:
+                with open(options.usage) as f: usage = json.load(f)
+            except ValueError:
+                pass
+            os.remove(options.usage)
+        ## The parent is the run script: the I/O of all the commands of the job
+        line = "%s %s" % (marker, json.dumps(make_record(options.section, options.exitCode, marks, usage, read_io(os.getppid()))))
+        print(line)
+        if options.append is not None:
+            try:
+                with open(options.append, "a") as f: print(line, file=f)
+            except OSError as e:
+                print("!!! Cannot write the timing record to %s: %s" % (options.append, e))
+    else:
+        print("Usage: %s run|report ..." % sys.argv[0])
+        sys.exit(1)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+## Lumi masks as sorted lists of closed intervals [[first, last], ...] per run, like the CMS lumi JSON files.
+## The set operations merge the interval lists, the cost does not depend on the number of lumisections.
+import sys, json
+
+def normalize(ranges):
+    ## Sorted, non-overlapping and non-adjacent intervals
+    out = []
+    for first, last in sorted(ranges):
+        if first > last: continue
+        if len(out) > 0 and first <= out[-1][1]+1:
+            if last > out[-1][1]: out[-1][1] = last
+        else:
+            out.append([first, last])
+    return out
+
+def union(a, b):
+    return normalize(a+b)
+
+def intersection(a, b):
+    out, i, j = [], 0, 0
+    while i < len(a) and j < len(b):
+        first, last = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if first <= last: out.append([first, last])
+        if a[i][1] < b[j][1]: i += 1
+        else: j += 1
+    return out
+
+def difference(a, b):
+    out, j = [], 0
+    for first, last in a:
+        while j < len(b) and b[j][1] < first: j += 1
+        k = j
+        while k < len(b) and b[k][0] <= last:
+            if b[k][0] > first: out.append([first, b[k][0]-1])
+            first = max(first, b[k][1]+1)
+            k += 1
+        if first <= last: out.append([first, last])
+    return out
+
+class LumiMask:
+    def __init__(self, runs={}, normalized=False):
+        ## {run(int): [[first, last], ...]}
+        if normalized: self.runs = dict(runs)
+        else: self.runs = dict((int(run), normalize(ranges)) for run, ranges in runs.items())
+        self.runs = dict((run, ranges) for run, ranges in self.runs.items() if len(ranges) > 0)
+
+    @classmethod
+    def load(cls, fileName):
+        with open(fileName) as f: return cls(json.load(f))
+
+    def __or__(self, other):
+        out = LumiMask()
+        for run in set(self.runs) | set(other.runs):
+            out.runs[run] = union(self.runs.get(run, []), other.runs.get(run, []))
+        return out
+
+    def __and__(self, other):
+        out = LumiMask()
+        for run in set(self.runs) & set(other.runs):
+            ranges = intersection(self.runs[run], other.runs[run])
+            if len(ranges) > 0: out.runs[run] = ranges
+        return out
+
+    def __sub__(self, other):
+        out = LumiMask()
+        for run, ranges in self.runs.items():
+            ranges = difference(ranges, other.runs[run]) if run in other.runs else [list(x) for x in ranges]
+            if len(ranges) > 0: out.runs[run] = ranges
+        return out
+
+    def filterRuns(self, minRun=None, maxRun=None):
+        return LumiMask(dict((run, ranges) for run, ranges in self.runs.items()
+                             if (minRun is None or run >= minRun) and (maxRun is None or run <= maxRun)), normalized=True)
+
+    def nLumis(self):
+        return sum(last-first+1 for ranges in self.runs.values() for first, last in ranges)
+
+    def toJSON(self):
+        ## Keys are strings in the run order
+        return dict((str(run), self.runs[run]) for run in sorted(self.runs))
+
+operators = {'and':LumiMask.__and__, 'or':LumiMask.__or__, 'not':LumiMask.__sub__}
+
+def evaluate(masks, ops):
+    ## masks[0] ops[0] masks[1] ops[1] masks[2] ..., from left to right
+    out = masks[0]
+    for op, mask in zip(ops, masks[1:]): out = operators[op](out, mask)
+    return out
+
+def legacy_join(js1, js2, op):
+    ## Set of all lumisections per run, as the former joinLumiJSON. Kept for the benchmark
+    runs = set(js1.keys()) | set(js2.keys()) if op == "or" else set(js1.keys())
+    out = {}
+    for run in runs:
+        if op == "and" and run not in js2: continue
+        lumis1, lumis2 = set(), set()
+        for x in js1.get(run, []): lumis1.update(range(x[0], x[1]+1))
+        for x in js2.get(run, []): lumis2.update(range(x[0], x[1]+1))
+        if op == "and": joined = lumis1 & lumis2
+        elif op == "or": joined = lumis1 | lumis2
+        else: joined = lumis1 - lumis2
+        if len(joined) == 0: continue
+        joined = sorted(joined)
+        outlumis = [[joined[0], joined[0]]]
+        for lumi in joined[1:]:
+            if lumi == outlumis[-1][1]+1: outlumis[-1][1] = lumi
+            else: outlumis.append([lumi, lumi])
+        out[run] = outlumis
+    return out
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+## Node-local cache of unpacked and built CMSSW areas, shared by the jobs on the same worker node
+##   CACHEDIR/KEY/       unpacked area, KEY/.ready is written once the build is done
+##   CACHEDIR/KEY.lock   held exclusively while the area is being built
+##   CACHEDIR/KEY.use    held shared by the running jobs ("flock -s" in the run script)
+## Entries are evicted in LRU order when the total size exceeds the limit, skipping entries in use.
+import os, sys, time, fcntl, shutil, tarfile, subprocess
+from optparse import OptionParser
+
+def dir_size(path):
+    size = 0
+    for p, dirs, files in os.walk(path):
+        for f in files:
+            try: size += os.lstat(os.path.join(p, f)).st_size
+            except OSError: pass
+    return size
+
+def area_dir(path):
+    ## The CMSSW_X_Y_Z directory inside a cache entry
+    return [os.path.join(path, x) for x in os.listdir(path) if os.path.isdir(os.path.join(path, x, 'src'))][0]
+
+class NodeCache:
+    def __init__(self, cacheDir, maxSize):
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        if not os.path.isdir(cacheDir): os.makedirs(cacheDir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cacheDir, key)
+
+    def lock(self, key, suffix, mode):
+        fd = os.open(self.path(key)+suffix, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, mode)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def unlock(self, fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def acquire(self, key, fill):
+        ## Return (path, hit). fill(path) is called by the first job only, the others wait for it
+        path = self.path(key)
+        fd = self.lock(key, '.lock', fcntl.LOCK_EX)
+        try:
+            hit = os.path.exists(os.path.join(path, '.ready'))
+            if not hit:
+                ## Remove leftovers of an interrupted build
+                if os.path.exists(path): shutil.rmtree(path, ignore_errors=True)
+                os.makedirs(path)
+                fill(path)
+                with open(os.path.join(path, '.size'), "w") as f: f.write(str(dir_size(path)))
+                open(os.path.join(path, '.ready'), "w").close()
+            os.utime(os.path.join(path, '.ready'))
+        finally:
+            self.unlock(fd)
+        return path, hit
+
+    def entries(self):
+        ## (last used, size, key) of complete entries
+        entries = []
+        for key in os.listdir(self.cacheDir):
+            ready = os.path.join(self.cacheDir, key, '.ready')
+            if not os.path.exists(ready): continue
+            try: size = int(open(os.path.join(self.cacheDir, key, '.size')).read())
+            except (OSError, ValueError): size = 0
+            entries.append((os.path.getmtime(ready), size, key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(x[1] for x in entries)
+        for lastUsed, size, key in entries:
+            if total <= self.maxSize: break
+            if key == keep: continue
+            useFd = self.lock(key, '.use', fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if useFd is None: continue ## in use by a running job
+            buildFd = self.lock(key, '.lock', fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if buildFd is not None:
+                os.remove(os.path.join(self.path(key), '.ready'))
+                shutil.rmtree(self.path(key), ignore_errors=True)
+                total -= size
+                print("@@ NODECACHE evicted %s (%.1f MB)" % (key, size/1e6), file=sys.stderr)
+                self.unlock(buildFd)
+            self.unlock(useFd)
+        return total
+
+if __name__ == '__main__':
+    parser = OptionParser("Usage: %prog --cacheDir DIR --key KEY --archive cmssw.tar.gz [--build COMMAND]\n"
+                          "Print the path of the unpacked area, unpack and build it if not in the cache")
+    parser.add_option("--cacheDir", dest="cacheDir", help="Node-local cache directory")
+    parser.add_option("--key", dest="key", help="Cache key, the sha1 of the archive content")
+    parser.add_option("--archive", dest="archive", help="Archive to unpack on a cache miss")
+    parser.add_option("--build", dest="build", default="", help="Command to run in the src directory of the unpacked area")
+    parser.add_option("--maxSize", dest="maxSize", type="float", default=20, help="Cache size limit in GB (default 20)")
+    (options, args) = parser.parse_args()
+    if None in (options.cacheDir, options.key, options.archive):
+        parser.print_help()
+        sys.exit(1)
+
+    def fill(path):
+        ## The CMSSW area has absolute links (/cvmfs/..), rejected by the "data" filter, the default from python 3.14
+        with tarfile.open(options.archive) as tar:
+            if hasattr(tarfile, 'fully_trusted_filter'): tar.extractall(path, filter='fully_trusted')
+            else: tar.extractall(path)
+        if options.build == '': return
+        if subprocess.call(options.build, shell=True, cwd=os.path.join(area_dir(path), 'src'), stdout=sys.stderr, executable='/bin/bash') != 0:
+            raise RuntimeError("Build failed in the node cache")
+
+    begin = time.time()
+    cache = NodeCache(options.cacheDir, options.maxSize*1e9)
+    try:
+        path, hit = cache.acquire(options.key, fill)
+    except Exception as e:
+        print("@@ NODECACHE failed:", e, file=sys.stderr)
+        sys.exit(2)
+    cache.evict(keep=options.key)
+    print("@@ NODECACHE %s %s in %.1f s" % ("HIT" if hit else "MISS", options.key[:12], time.time()-begin), file=sys.stderr)
+    print(area_dir(path))
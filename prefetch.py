@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+## Background prefetch of the input files of a job section into a node-local cache
+## The files are copied in the order of the section, in parallel, into NodeCache entries shared by the jobs
+## of the node (locked while copied, LRU eviction beyond the size limit). The map of the files already
+## available is rewritten after each copy. job_cfg.py waits for it up to $PREFETCH_WAIT seconds, then reads
+## the available files with file: and the others remotely. The entries are kept in use until the job ends.
+import os, sys, re, json, time, fcntl, hashlib, subprocess, threading
+from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor
+from nodecache import NodeCache
+
+def source_url(fileName, redirector):
+    ## LFNs are read through the redirector, root://host/ or root://host//base, other names are used as they are
+    if fileName.startswith('/store/'):
+        if re.match(r'^[a-z]+://[^/]+/*$', redirector): return redirector.rstrip('/')+'/'+fileName
+        return redirector.rstrip('/')+fileName
+    if fileName.startswith('file:'): return fileName[len('file:'):]
+    return fileName
+
+def copy_file(src, dest, timeout):
+    if src.startswith('root://'): cmd = ['xrdcp', '-s', '-f', src, dest]
+    else: cmd = ['cp', src, dest]
+    subprocess.run(cmd, check=True, timeout=timeout, stdout=subprocess.DEVNULL)
+
+def write_map(mapFile, files, done):
+    with open(mapFile+".tmp", "w") as f: json.dump({'done':done, 'files':files}, f)
+    os.replace(mapFile+".tmp", mapFile)
+
+def read_map(mapFile):
+    try:
+        with open(mapFile) as f: return json.load(f)
+    except (OSError, ValueError):
+        return {'done':False, 'files':{}}
+
+def wait_map(mapFile, waitTime):
+    ## {fileName: local path} once the prefetch is done or after waitTime seconds.
+    ## The files not started yet are then left to the job, the prefetch stops
+    deadline = time.time()+waitTime
+    m = read_map(mapFile)
+    while not m['done'] and time.time() < deadline:
+        time.sleep(1)
+        m = read_map(mapFile)
+    open(mapFile+".stop", "w").close()
+    return dict((x, p) for x, p in m['files'].items() if os.path.exists(p))
+
+class Prefetcher:
+    def __init__(self, cache, redirectors, nParallel=4, timeout=3600):
+        self.cache = cache
+        self.redirectors = redirectors ## tried in order, the site xrootd first
+        self.nParallel = nParallel
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.files = {} ## fileName: local path
+        self.useFds = []
+        self.stats = {'hit':0, 'miss':0, 'fail':0, 'skip':0, 'bytes':0}
+
+    def fetch(self, fileName, mapFile):
+        if os.path.exists(mapFile+".stop"):
+            with self.lock: self.stats['skip'] += 1
+            return
+        key = hashlib.sha1(fileName.encode()).hexdigest()
+        localName = os.path.basename(fileName) or 'input.root'
+        ## Shared lock first, an entry in use by a job is never evicted
+        useFd = self.cache.lock(key, '.use', fcntl.LOCK_SH)
+        def fill(path):
+            sources = list(dict.fromkeys(source_url(fileName, x) for x in self.redirectors))
+            for i, src in enumerate(sources):
+                try:
+                    copy_file(src, os.path.join(path, localName), self.timeout)
+                    return
+                except (OSError, subprocess.SubprocessError):
+                    if i == len(sources)-1: raise
+        try:
+            path, hit = self.cache.acquire(key, fill)
+        except Exception as e:
+            print("@@ PREFETCH failed %s: %s" % (fileName, e), file=sys.stderr)
+            self.cache.unlock(useFd)
+            with self.lock: self.stats['fail'] += 1
+            return
+        self.cache.evict(keep=key)
+        with self.lock:
+            self.useFds.append(useFd)
+            self.stats['hit' if hit else 'miss'] += 1
+            if not hit: self.stats['bytes'] += os.path.getsize(os.path.join(path, localName))
+            self.files[fileName] = os.path.join(path, localName)
+            write_map(mapFile, self.files, False)
+
+    def run(self, fileNames, mapFile):
+        write_map(mapFile, {}, False)
+        with ThreadPoolExecutor(max_workers=self.nParallel) as pool:
+            list(pool.map(lambda x: self.fetch(x, mapFile), fileNames))
+        write_map(mapFile, self.files, True)
+
+    def release(self):
+        for fd in self.useFds: self.cache.unlock(fd)
+        self.useFds = []
+
+if __name__ == '__main__':
+    parser = OptionParser("Usage: %prog --cacheDir DIR --map FILE (--manifest FILE --section N | FILE1 FILE2 ...)")
+    parser.add_option("--cacheDir", dest="cacheDir", help="Node-local cache directory")
+    parser.add_option("--maxSize", dest="maxSize", type="float", default=50, help="Cache size limit in GB (default 50)")
+    parser.add_option("--map", dest="mapFile", help="Map of the prefetched files, read by job_cfg.py")
+    parser.add_option("--manifest", dest="manifest", help="Job manifest to take the input files from")
+    parser.add_option("--section", dest="section", type="int", default=None, help="Section of the manifest")
+    parser.add_option("--redirector", dest="redirector", default=None, help="Site xrootd for the LFNs, root://host//base")
+    parser.add_option("--fallback", dest="fallback", default="root://cms-xrd-global.cern.ch/",
+                      help="xrootd redirector for the LFNs not read from the site (default root://cms-xrd-global.cern.ch/)")
+    parser.add_option("-j", "--parallel", dest="nParallel", type="int", default=4, help="Number of simultaneous copies (default 4)")
+    parser.add_option("--watch", dest="watch", type="int", default=None, help="Keep the files in use until this process ends")
+    (options, args) = parser.parse_args()
+    if options.cacheDir is None or options.mapFile is None:
+        parser.print_help()
+        sys.exit(1)
+    fileNames = args
+    if options.manifest is not None:
+        from jobmanifest import read_section
+        fileNames = read_section(options.manifest, options.section).get('fileNames', [])
+
+    begin = time.time()
+    redirectors = [x for x in (options.redirector, options.fallback) if x]
+    prefetcher = Prefetcher(NodeCache(options.cacheDir, options.maxSize*1e9), redirectors, options.nParallel)
+    prefetcher.run(fileNames, options.mapFile)
+    stats = prefetcher.stats
+    line = "@@ PREFETCH %d files: %d hit, %d miss (%.1f MB), %d failed, %d left to the job in %.1f s" % (len(fileNames),
+           stats['hit'], stats['miss'], stats['bytes']/1e6, stats['fail'], stats['skip'], time.time()-begin)
+    print(line, file=sys.stderr)
+    ## Statistics of the node, one line per job
+    try:
+        with open(os.path.join(options.cacheDir, "prefetch_stats.log"), "a") as f:
+            print(json.dumps(dict(stats, time=int(begin), seconds=round(time.time()-begin, 1), nFiles=len(fileNames))), file=f)
+    except OSError:
+        pass
+
+    ## Hold the shared locks while the job runs
+    while options.watch is not None:
+        try:
+            os.kill(options.watch, 0)
+        except OSError:
+            break
+        time.sleep(10)
+    prefetcher.release()
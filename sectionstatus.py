@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+## Status of the sections of a create-batch workspace, from the files the jobs leave behind
+##   condor.log         : last event of each condor job (idle, running, held, done with its exit code)
+##   job_N.log/.err     : TERMINATED_N and STAGEOUT_FAILED lines, fatal exceptions, "@@ TIMING" records
+##   timing.log         : "@@ TIMING" records of the LSB/PBS jobs
+##   outputs            : PREFIX_NNN.EXT at the destination (PREFIX_N.EXT in the workspace without transfer)
+## The detection only reads files, the output listing can be given to classify() to run it on fixtures.
+import os, sys, re, json
+from jobtiming import read_records
+from jobmanifest import ManifestWriter, read_all
+
+stateFileName = 'resubmit_state.json'
+manifestFileName = 'job_manifest_resubmit.txt'
+
+def read_meta(jobDir):
+    try:
+        with open(os.path.join(jobDir, '.create-batch')) as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def read_state(jobDir):
+    ## Sections added by the splits {"splits": {orig: [new, ...]}, "nSection": N}
+    fileName = os.path.join(jobDir, stateFileName)
+    if not os.path.exists(fileName): return {'splits':{}, 'nSection':None}
+    with open(fileName) as f: state = json.load(f)
+    state['splits'] = dict((int(k), v) for k, v in state['splits'].items())
+    return state
+
+def save_state(jobDir, state):
+    fileName = os.path.join(jobDir, stateFileName)
+    with open(fileName+".tmp", "w") as f: json.dump(state, f)
+    os.replace(fileName+".tmp", fileName)
+
+def parse_condor_log(fileName, clusters={}):
+    ## {section: (cluster, state, detail)} from the last event of the latest job of each section
+    ## clusters: {cluster: [sections]} of the partial submissions, where the process number is the index in the list
+    events = {}
+    if not os.path.exists(fileName): return events
+    header = re.compile(r'^(\d{3}) \((\d+)\.(\d+)\.\d+\)')
+    with open(fileName, errors='replace') as f:
+        event = None
+        for line in f:
+            m = header.match(line)
+            if m is not None:
+                code, cluster, proc = m.group(1), int(m.group(2)), int(m.group(3))
+                sections = clusters.get(cluster)
+                section = sections[proc] if sections is not None and proc < len(sections) else proc
+                event = None
+                if code in ('000', '001', '002', '004', '005', '007', '009', '012', '013'):
+                    old = events.get(section)
+                    if old is None or old[0] <= cluster:
+                        events[section] = [cluster, code, '']
+                        event = events[section]
+                continue
+            if event is None or line.startswith('...'): continue
+            ## Details of the termination and hold events
+            m = re.search(r'return value (\d+)', line)
+            if m: event[2] = int(m.group(1))
+            m = re.search(r'signal (\d+)', line)
+            if m: event[2] = 'signal %s' % m.group(1)
+            if event[1] in ('012', '009', '002') and event[2] == '' and line.strip() != '': event[2] = line.strip()
+    states = {'000':'idle', '001':'running', '002':'failed', '004':'idle', '005':'done', '007':'idle', '009':'aborted',
+              '012':'held', '013':'idle'}
+    return dict((section, (cluster, states[code], detail)) for section, (cluster, code, detail) in events.items())
+
+def scan_job_log(fileName):
+    ## Failure reason from the run script output, None if it did not fail, '' if it did not end
+    if not os.path.exists(fileName): return ''
+    reason = ''
+    with open(fileName, errors='replace') as f:
+        for line in f:
+            if line.startswith('TERMINATED_'): reason = "exit code %s" % line.split()[0][len('TERMINATED_'):]
+            elif line.startswith('STAGEOUT_FAILED'): reason = "stage-out failed"
+            elif line.startswith('FINISHED'): reason = None
+    return reason
+
+def scan_job_err(fileName):
+    if not os.path.exists(fileName): return None
+    with open(fileName, errors='replace') as f:
+        for line in f:
+            if 'Begin Fatal Exception' in line: return "fatal exception"
+            if 'Segmentation' in line or 'segmentation violation' in line: return "segmentation violation"
+    return None
+
+def output_names(meta, section):
+    ## File names of the outputs of a section, and the directory they go to
+    names = []
+    for fileName in dict.fromkeys(meta.get('outFileNames', [])):
+        prefix, ext = os.path.splitext(fileName)
+        if meta.get('transferCmd', '') == '': names.append("%s_%d%s" % (prefix, section, ext))
+        else: names.append("%s_%03d%s" % (prefix, section, ext))
+    return names
+
+def list_outputs(jobDir, meta):
+    ## Set of file names at the destination, None if it cannot be listed
+    from dirlisting import PosixLister, XRootDLister
+    dest = meta.get('dest', jobDir) if meta.get('transferCmd', '') != '' else jobDir
+    m = re.match(r'^root://([^/]+)/(/.*)$', dest)
+    if m is not None: lister, path = XRootDLister(m.group(1)), m.group(2)
+    elif dest.startswith('/'): lister, path = PosixLister(), dest
+    else: return None
+    try:
+        entries = lister.listdir(path.rstrip('/'))
+    except OSError:
+        return None
+    return set() if entries is None else set(entries.keys())
+
+def read_clusters(jobDir):
+    ## {cluster: [sections]} recorded by the partial submissions of batchsubmit
+    fileName = os.path.join(jobDir, 'submit_state.json')
+    if not os.path.exists(fileName): return {}
+    with open(fileName) as f: return dict((int(k), v) for k, v in json.load(f).get('clusters', {}).items())
+
+def classify(jobDir, meta=None, outputs=None, state=None, clusters=None):
+    ## {section: (status, reason)}, status is ok, failed, missing, idle, running, held or split
+    ## outputs: set of the file names at the destination, None to skip the output check
+    if meta is None: meta = read_meta(jobDir)
+    if state is None: state = read_state(jobDir)
+    if clusters is None: clusters = read_clusters(jobDir)
+    nSection = state.get('nSection') or meta.get('nSection') or 0
+    events = parse_condor_log(os.path.join(jobDir, 'condor.log'), clusters)
+    records = read_records(jobDir)
+    splitChildren = dict((x, orig) for orig, news in state['splits'].items() for x in news)
+    status = {}
+    for section in range(nSection):
+        if section in state['splits']:
+            status[section] = ('split', "into %s" % ",".join(str(x) for x in state['splits'][section]))
+            continue
+        event = events.get(section)
+        if event is not None and event[1] in ('idle', 'running', 'held'):
+            status[section] = (event[1], str(event[2]))
+            continue
+        reasons = []
+        if event is not None and event[1] in ('aborted', 'failed'): reasons.append("condor %s %s" % (event[1], event[2]))
+        if event is not None and event[1] == 'done' and event[2] not in ('', 0): reasons.append("condor exit %s" % event[2])
+        for logName in ("job_%d.log" % section, "job_%03d.log" % section):
+            reason = scan_job_log(os.path.join(jobDir, logName))
+            if reason: reasons.append(reason)
+        reason = scan_job_err(os.path.join(jobDir, "job_%d.err" % section))
+        if reason: reasons.append(reason)
+        record = records.get(section)
+        if record is not None and record.get('exitCode') != 0:
+            reasons.append("exit code %s in %s" % (record.get('exitCode'), record.get('lastPhase')))
+        missing = []
+        if outputs is not None: missing = [x for x in output_names(meta, section) if x not in outputs]
+        if len(reasons) > 0:
+            status[section] = ('failed', "; ".join(dict.fromkeys(reasons)))
+        elif len(missing) > 0:
+            ran = event is not None or record is not None or os.path.exists(os.path.join(jobDir, "job_%d.log" % section))
+            status[section] = ('failed' if ran else 'missing', "no output %s" % ",".join(missing))
+        elif event is None and record is None and outputs is None:
+            status[section] = ('missing', "no trace of the job")
+        else:
+            status[section] = ('ok', '')
+        if section in splitChildren and status[section][0] == 'ok':
+            status[section] = ('ok', "part of %d" % splitChildren[section])
+    return status
+
+def split_sections(jobDir, sections, nParts, state=None):
+    ## Rewrite the input files of the sections into nParts new sections each, appended after the last section.
+    ## The jobs read the new manifest through $JOB_MANIFEST. Return {orig: [new sections]}
+    if state is None: state = read_state(jobDir)
+    baseName = os.path.join(jobDir, manifestFileName)
+    if not os.path.exists(baseName): baseName = os.path.join(jobDir, 'job_manifest.txt')
+    common, records = read_all(baseName)
+    newSplits = {}
+    for section in sections:
+        fileNames = records[section].get('fileNames', [])
+        n = min(nParts, len(fileNames))
+        if n < 2: continue
+        newSplits[section] = []
+        for i in range(n):
+            record = dict(records[section])
+            record['fileNames'] = fileNames[i::n]
+            newSplits[section].append(len(records))
+            records.append(record)
+    if len(newSplits) == 0: return newSplits
+    manifest = ManifestWriter(os.path.join(jobDir, manifestFileName), common)
+    for record in records: manifest.add(record)
+    manifest.close()
+    state['splits'].update(newSplits)
+    state['nSection'] = len(records)
+    save_state(jobDir, state)
+    return newSplits
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: %s WORKSPACE\nPrint the status of each section" % sys.argv[0])
+        sys.exit(1)
+    if not os.path.exists(os.path.join(sys.argv[1], '.create-batch')):
+        print("!!! Not a create-batch workspace:", sys.argv[1])
+        sys.exit(1)
+    meta = read_meta(sys.argv[1])
+    for section, (status, reason) in sorted(classify(sys.argv[1], meta, list_outputs(sys.argv[1], meta)).items()):
+        print("%03d %-8s %s" % (section, status, reason))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+## Stage-out of the job outputs, shipped in job.tar.gz and called by the run scripts of create-batch
+## The files are copied concurrently by the transfer command, retried with exponential backoff and
+## verified by size and adler32 against the local file. One JSON record is written and echoed in the log.
+import os, sys, re, json, time, random, socket, shlex, signal, subprocess
+from optparse import OptionParser
+from concurrent.futures import ThreadPoolExecutor
+from checksum import adler32_file, remote_adler32
+
+def remote_size(url):
+    ## root://host//path -> size by xrdfs stat, None if the query fails
+    m = re.match(r'^root://([^/]+)/(/.*)$', url)
+    if m is None: return None
+    p = subprocess.run(['xrdfs', m.group(1), 'stat', m.group(2)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    m = re.search(r'Size:\s*(\d+)', p.stdout)
+    return int(m.group(1)) if p.returncode == 0 and m else None
+
+def is_hadoop(cmd):
+    return cmd.split()[:2] in (['hadoop', 'fs'], ['hdfs', 'dfs'])
+
+def hadoop_size(dest, cmd):
+    ## Size by hadoop fs -stat, None if the query fails
+    try:
+        p = subprocess.run(cmd.split()[:2]+['-stat', '%b', dest], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           universal_newlines=True, timeout=300)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    out = p.stdout.strip()
+    return int(out) if p.returncode == 0 and out.isdigit() else None
+
+def retry_cmd(cmd):
+    ## hadoop fs -put refuses to overwrite the file left by a failed attempt
+    if is_hadoop(cmd) and re.search(r'\s-put\s+-f\b', cmd) is None: return re.sub(r'(\s-put)\b', r'\1 -f', cmd, count=1)
+    return cmd
+
+def verify(dest, size, checksum, cmd=''):
+    ## (ok, message). Destinations that cannot be checked are taken as they are.
+    ## HDFS paths (hadoop fs) are not mounted on the nodes, only the size is compared: the hadoop checksum is not adler32
+    if is_hadoop(cmd):
+        destSize = hadoop_size(dest, cmd)
+        if destSize is None: return True, "not verified"
+        if destSize != size: return False, "size %d != %d" % (destSize, size)
+        return True, "adler32 not available"
+    if dest.startswith('root://'):
+        destSize = remote_size(dest)
+        if destSize != size: return False, "size %s != %d" % (destSize, size)
+        destSum = remote_adler32(dest)
+        if destSum is not None and destSum != checksum: return False, "adler32 %s != %s" % (destSum, checksum)
+        return True, "" if destSum is not None else "adler32 not available"
+    if '://' in dest or not dest.startswith('/'):
+        return True, "not verified"
+    if not os.path.exists(dest): return False, "missing at the destination"
+    if os.path.getsize(dest) != size: return False, "size %d != %d" % (os.path.getsize(dest), size)
+    if adler32_file(dest) != checksum: return False, "adler32 mismatch"
+    return True, ""
+
+def stageout(src, dest, cmd, retries, backoff, timeout):
+    record = {'src':src, 'dest':dest, 'ok':False, 'attempts':0, 'error':''}
+    if not os.path.exists(src):
+        record['error'] = "no output file"
+        return record
+    ## Before the copy, the transfer command may move the file
+    record['size'] = os.path.getsize(src)
+    record['adler32'] = adler32_file(src)
+    begin = time.time()
+    for attempt in range(retries+1):
+        if attempt > 0:
+            delay = min(300., backoff*2**(attempt-1))*random.uniform(0.5, 1.5)
+            print("Failed to copy %s (%s).. retry in %.0f seconds" % (src, record['error'], delay))
+            time.sleep(delay)
+        record['attempts'] = attempt+1
+        command = "%s %s %s" % (cmd if attempt == 0 else retry_cmd(cmd), shlex.quote(src), shlex.quote(dest))
+        print(command)
+        proc = subprocess.Popen(command, shell=True, start_new_session=True)
+        try:
+            ret = proc.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            ## Stop the whole command, not only the shell
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+            record['error'] = "timeout after %d s" % timeout
+            continue
+        if ret != 0:
+            record['error'] = "exit code %d" % ret
+            continue
+        ok, message = verify(dest, record['size'], record['adler32'], cmd)
+        record['error'] = message
+        if ok:
+            record['ok'] = True
+            break
+        if not os.path.exists(src): break ## moved, cannot be sent again
+    record['seconds'] = round(time.time()-begin, 1)
+    return record
+
+if __name__ == '__main__':
+    parser = OptionParser("Usage: %prog --cmd TRANSFERCMD --dest DESTDIR [options] FILE1 FILE2 ...\n"
+                          "Copy FILE to DESTDIR/PREFIX${SUFFIX}.EXT with TRANSFERCMD FILE DEST")
+    parser.add_option("--cmd", dest="cmd", help="Transfer command (ex. \"xrdcp -f\", \"cp\", \"mv\")")
+    parser.add_option("--dest", dest="dest", help="Destination directory")
+    parser.add_option("--suffix", dest="suffix", default="", help="Suffix added to the file names (ex. _001)")
+    parser.add_option("--retries", dest="retries", type="int", default=4, help="Number of retries (default 4)")
+    parser.add_option("--backoff", dest="backoff", type="float", default=5., help="First retry delay in seconds, doubled each retry (default 5)")
+    parser.add_option("--timeout", dest="timeout", type="float", default=3600., help="Time limit of one copy in seconds (default 3600)")
+    parser.add_option("-j", "--parallel", dest="nParallel", type="int", default=4, help="Number of files copied simultaneously (default 4)")
+    parser.add_option("--result", dest="result", default="stageout.json", help="Result record (default stageout.json)")
+    (options, args) = parser.parse_args()
+    if options.cmd is None or options.dest is None or len(args) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    def destName(fileName):
+        prefix, ext = os.path.splitext(os.path.basename(fileName))
+        return "%s/%s%s%s" % (options.dest.rstrip('/'), prefix, options.suffix, ext)
+
+    begin = time.time()
+    with ThreadPoolExecutor(max_workers=options.nParallel) as pool:
+        records = list(pool.map(lambda x: stageout(x, destName(x), options.cmd, options.retries, options.backoff, options.timeout), args))
+    result = {'host':socket.gethostname(), 'seconds':round(time.time()-begin, 1), 'ok':all(x['ok'] for x in records), 'files':records}
+    with open(options.result, "w") as f: json.dump(result, f)
+    print("@@ STAGEOUT", json.dumps(result))
+    sys.exit(0 if result['ok'] else 1)
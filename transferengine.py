@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+## Concurrent file transfers with retries and an on-disk journal, shared by xrdDownload.py and cmsDownload.py
+import os, sys, re, time, random, sqlite3, threading, subprocess, shlex
+from concurrent.futures import ThreadPoolExecutor
+
+class CommandCopier:
+    ## Copy by a shell command template, ex. "xrdcp -p -f {src} {dest}". {key} is the LFN of the file
+    def __init__(self, template, verbose=False):
+        self.template = template
+        self.verbose = verbose
+
+    def __call__(self, key, src, dest):
+        cmd = self.template.format(key=shlex.quote(key), src=shlex.quote(src), dest=shlex.quote(dest))
+        if self.verbose: print(cmd)
+        out = None if self.verbose else subprocess.DEVNULL
+        return subprocess.call(cmd, shell=True, stdout=out, stderr=out)
+
+class TransferJournal:
+    ## One row per file. The completed files are skipped when the transfer is resumed
+    def __init__(self, fileName):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(fileName, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS transfers (key TEXT PRIMARY KEY, src TEXT, dest TEXT,
+                           size INTEGER, state TEXT, attempts INTEGER, error TEXT, updated REAL)""")
+        self.db.commit()
+
+    def update(self, key, src, dest, size, state, attempts=0, error=''):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO transfers VALUES (?,?,?,?,?,?,?,?)",
+                            (key, src, dest, size, state, attempts, error, time.time()))
+            self.db.commit()
+
+    def addPending(self, tasks):
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO transfers VALUES (?,?,?,?,'pending',0,'',?)",
+                                [(key, src, dest, size, time.time()) for key, src, dest, size in tasks])
+            self.db.commit()
+
+    def keys(self, state):
+        with self.lock:
+            return set(x[0] for x in self.db.execute("SELECT key FROM transfers WHERE state=?", (state,)))
+
+    def close(self):
+        self.db.close()
+
+class TransferStats:
+    def __init__(self, nTotal):
+        self.lock = threading.Lock()
+        self.nTotal = nTotal
+        self.nDone, self.nFail, self.nRetry, self.nBytes = 0, 0, 0, 0
+        self.begin = time.time()
+
+    def add(self, ok, size):
+        with self.lock:
+            if ok:
+                self.nDone += 1
+                self.nBytes += max(0, size or 0)
+            else:
+                self.nFail += 1
+
+    def summary(self):
+        elapsed = max(1e-6, time.time()-self.begin)
+        return "Total: %d / Success: %d / Fail: %d / Retried: %d / %.2f files/s / %.1f MB/s" % (
+               self.nTotal, self.nDone, self.nFail, self.nRetry, self.nDone/elapsed, self.nBytes/1e6/elapsed)
+
+def source_host(url):
+    m = re.match(r'^\w+://([^/]+)/', url)
+    return m.group(1) if m else ''
+
+class TransferEngine:
+    def __init__(self, copier, nParallel=4, perSource=None, retries=3, backoff=10., maxBackoff=300.,
+                 journal=None, statInterval=30.):
+        self.copier = copier
+        self.nParallel = nParallel
+        self.perSource = perSource
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.journal = journal
+        self.statInterval = statInterval
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def sourceSemaphore(self, src):
+        if self.perSource is None: return None
+        host = source_host(src)
+        with self.lock:
+            if host not in self.semaphores: self.semaphores[host] = threading.Semaphore(self.perSource)
+            return self.semaphores[host]
+
+    def transfer(self, task):
+        key, src, dest, size = task
+        sem = self.sourceSemaphore(src)
+        for attempt in range(self.retries+1):
+            if attempt > 0:
+                ## Exponential backoff with jitter, the slot of the source is released while waiting
+                delay = min(self.maxBackoff, self.backoff*2**(attempt-1))*random.uniform(0.5, 1.5)
+                print("%s is failed. Retry in %.0f s (%d/%d)" % (key, delay, attempt, self.retries))
+                with self.stats.lock: self.stats.nRetry += 1
+                time.sleep(delay)
+            if sem is not None: sem.acquire()
+            try:
+                ret = self.copier(key, src, dest)
+            except OSError as e:
+                ret = str(e)
+            finally:
+                if sem is not None: sem.release()
+            if ret == 0: break
+        ok = (ret == 0)
+        if self.journal is not None:
+            self.journal.update(key, src, dest, size, 'done' if ok else 'failed', attempt+1, '' if ok else str(ret))
+        self.stats.add(ok, size)
+        if not ok: print("%s is failed." % key)
+        return ok
+
+    def report(self, finished):
+        while not finished.wait(self.statInterval):
+            print("@@", self.stats.summary())
+
+    def run(self, tasks, resume=False):
+        ## tasks: list of (key, src, dest, size). Return the keys of the failed transfers
+        if resume and self.journal is not None:
+            completed = self.journal.keys('done')
+            nAll = len(tasks)
+            tasks = [x for x in tasks if x[0] not in completed]
+            print("Resume: %d files are already transferred, %d files to go" % (nAll-len(tasks), len(tasks)))
+        self.stats = TransferStats(len(tasks))
+        if self.journal is not None: self.journal.addPending(tasks)
+
+        finished = threading.Event()
+        reporter = threading.Thread(target=self.report, args=(finished,), daemon=True)
+        reporter.start()
+        with ThreadPoolExecutor(max_workers=self.nParallel) as pool:
+            results = list(pool.map(self.transfer, tasks))
+        finished.set()
+        print(self.stats.summary())
+        return [task[0] for task, ok in zip(tasks, results) if not ok]
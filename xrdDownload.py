@@ -1,22 +1,16 @@
 #!/usr/bin/env python3
 
 import os, subprocess, sys, socket
-from multiprocessing import Pool, Value
 from optparse import OptionParser
 
+from transferengine import TransferEngine, TransferJournal, CommandCopier
+from dirlisting import DirectoryIndex, PosixLister, make_plan
+
 
 XRDFB="root://cms-xrd-global.cern.ch/"
 XRDDEST="root://cms-xrdr.private.lo:2094//xrd/"
-
-
-def init(total, success, fail):
-    global g_total
-    global g_success
-    global g_fail
-    g_total = total
-    g_success = success
-    g_fail = fail
-
+## Remove the old file at the destination before the copy
+COPYCMD="xrdfs cms-xrdr.private.lo:2094 rm /xrd{key}; xrdcp -p -f {src} {dest}"
 
 
 def subprocess_open(command):
@@ -25,33 +19,6 @@ def subprocess_open(command):
     returncode = popen 
     return stdoutdata, stderrdata
 
-def migration(lfn):
-    source = XRDFB+lfn
-    dest = XRDDEST+lfn
-    xrd_locate = '/xrd'+lfn
-    xrd_dir = '/xrd'+os.path.dirname(lfn)
-    cmd = 'xrdfs cms-xrdr.private.lo:2094 rm %s'%(xrd_locate)
-    os.system(cmd)
-
-    global g_total
-    global g_success
-    global g_fail
-
-
-    print("Source: ",source)
-    print("Destination: ",dest)
-    cmd = 'xrdcp -p -f %s %s'%(source ,dest)
-    return_value = os.system(cmd)
-    if( return_value !=0 ):
-        print("%s is failed."%(lfn))
-        with g_fail.get_lock():
-            g_fail.value += 1
-    else:
-        with g_success.get_lock():
-            g_success.value += 1
-    print("Total: %d / Success: %d / Fail: %d\n"%(g_total.value, g_success.value, g_fail.value))
-    return None
-
 class xrdDownload():
     lfnsize={}
     target=[]
@@ -67,7 +34,7 @@ class xrdDownload():
             os.system("voms-proxy-init --voms cms -hours 192 -valid 192:0")
         self.parseOptions()
         self.checkDestFiles()
-        self.runDownload()
+        if not self.dryRun: self.runDownload()
     def parseOptions(self):
         usage="Usage: xrdDownload.py [options] \n(ex) xrdDownload.py -i datalist.txt -p 4"
         parser = OptionParser(usage)
@@ -75,10 +42,20 @@ class xrdDownload():
         parser.add_option("-f", "--force" , dest="force"   ,action="store_true", default=False, help ="force to copy")
         parser.add_option("-p", "--parallel", dest="nparallel",default=4, help="number of copy jobs to be run simultaneously")
         parser.add_option("-v", "--verbose", dest="verbose",action="store_true", help="Verbose mode")
+        parser.add_option("-r", "--resume", dest="resume",action="store_true", default=False, help="Skip the files completed in the journal")
+        parser.add_option("-j", "--journal", dest="journal",default="xrdDownload.db", help="Transfer journal (default xrdDownload.db)")
+        parser.add_option("--retries", dest="retries",type="int", default=3, help="Number of retries of a failed copy (default 3)")
+        parser.add_option("--copyCmd", dest="copyCmd",default=COPYCMD, help="Copy command with {src}, {dest} and {key}(LFN) (default \"%s\")"%(COPYCMD))
+        parser.add_option("-n", "--dryRun", dest="dryRun",action="store_true", default=False, help="Write the transfer plan only")
         (options, args) = parser.parse_args()
         self.nparallel = int(options.nparallel)
         self.force = options.force
         self.verbose = options.verbose
+        self.resume = options.resume
+        self.journal = options.journal
+        self.retries = options.retries
+        self.copyCmd = options.copyCmd
+        self.dryRun = options.dryRun
         if ( self.verbose): 
             print("Verbose mode is on.")
         self.readList(options.listfile)
@@ -111,11 +88,11 @@ class xrdDownload():
     def printTarget(self):
         print(self.target)
     def runDownload(self):
-        g_total = Value('i',len(self.target))
-        g_success = Value('i',0)
-        g_fail = Value('i',0)
-        with Pool(initializer = init, initargs = (g_total, g_success, g_fail,), processes = self.nparallel) as p:
-            p.map(migration, self.target)
+        tasks = [(lfn, self.sourceFileName(lfn), self.destFileName(lfn), int(self.lfnsize[lfn]) if int(self.lfnsize[lfn]) > 0 else None) for lfn in self.target]
+        journal = TransferJournal(self.journal)
+        engine = TransferEngine(CommandCopier(self.copyCmd, self.verbose), nParallel=self.nparallel, retries=self.retries, journal=journal)
+        failed_list = engine.run(tasks, resume=self.resume)
+        journal.close()
         with open("failed_list.txt","w") as f:
             for failed_file in failed_list:
                 f.write("%s\n"%failed_file)
@@ -126,34 +103,20 @@ class xrdDownload():
     def pnfsFileName(self, lfn):
         return("/xrootd/"+lfn)
     def checkDestFiles(self):
-        for lfn in self.lfnsize.keys():
-            pnfs = self.pnfsFileName(lfn)
-            if( not os.path.isfile(pnfs)):
-                if( self.verbose):
-                    print("missing file %s"%(lfn))
-                self.target.append(lfn)
-                continue
-            if ( self.force ): 
-                if( self.verbose):
-                    print("Verbose mode: Add %s to list"%(lfn))
-                self.target.append(lfn)
-                continue
-            pfn_size = os.path.getsize(pnfs)
-            if ( int(pfn_size) == int(self.lfnsize[lfn])):
-                if(self.verbose):
-                    print("File is already existed. Skip this file.(%s)"%(lfn))
-                pass
-            else:
-                if(self.verbose):
-                    print("Wrong size of %s"%(lfn))
-                self.target.append(lfn)
+        ## One listing of each directory on the /xrootd mount instead of a stat per file
+        dest = DirectoryIndex(PosixLister("/xrootd"), self.nparallel*4)
+        plan = make_plan(list(self.lfnsize.keys()), self.lfnsize, dest, force=self.force)
+        if(self.verbose):
+            for lfn, size, reason in plan.copy:
+                print("Add %s to list (%s)"%(lfn, reason))
+        self.target = [x[0] for x in plan.copy]
+        plan.write("transfer_plan.txt")
+        print(plan.summary())
 
 
 
 if __name__ == '__main__':
 
-    lfn_list=[]
-    failed_list=[]
     xrdDownload()
         
 
@@ -7,6 +7,11 @@ import socket
 import getpass
 from pathlib import Path
 import glob
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from checksum import ChecksumCache, remote_adler32
 
 def subprocess_open(command):
     popen = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
@@ -38,7 +43,13 @@ class XrdMigration:
         parser.add_option("-c", "--cernid", dest="cernid",help="Input your CERN username. (Default) Query from CRIC.")
         parser.add_option("-d", "--delete", dest="delete",action="store_true",default= False, help="Delete copied files. (Default) False")
         parser.add_option("-n", "--dryrun", dest="dryrun",action="store_true",default= False, help="Dry Run")
+        parser.add_option("-p", "--parallel", dest="nparallel",type="int",default=4, help="Number of files copied simultaneously. (Default) 4")
+        parser.add_option("-r", "--retries", dest="retries",type="int",default=2, help="Number of copies retried after a checksum mismatch. (Default) 2")
+        parser.add_option("--cache", dest="cache",default=os.path.expanduser("~/.xrdMigration_adler32.db"), help="Checksum cache of the local files. (Default) ~/.xrdMigration_adler32.db")
         (options, args) = parser.parse_args()
+        self.nparallel = options.nparallel
+        self.retries = options.retries
+        self.cacheFile = options.cache
         self.delete_flag= options.delete
         self.destprepend=options.destprepend
         self.dryrun=options.dryrun
@@ -107,25 +118,52 @@ class XrdMigration:
             print("options : ",self.options)
         if ( self.args is not None):
             print("args : ",self.args)
+    def migrateFile(self, src, hashPool):
+        ## Copy, then compare adler32 of both sides. The local checksum is computed while the file is being copied
+        localHash = hashPool.submit(self.cache.adler32, src)
+        for attempt in range(self.retries+1):
+            ## The first copy does not overwrite, a file copied by a previous run is only verified
+            cmd = ["xrdcp", "-p"] + (["-f"] if attempt > 0 else []) + ["-s", src, self.dest[src]]
+            copied = subprocess.call(cmd) == 0
+            srcHash = localHash.result()
+            destHash = remote_adler32(self.dest[src])
+            if destHash is not None and srcHash == destHash:
+                break
+            print("Checksum mismatch of %s (%s / %s)%s"%(src, srcHash, destHash, "" if copied else ", copy failed"))
+        else:
+            with self.lock:
+                self.failed.append(src)
+            return False
+        with self.lock:
+            self.nDone += 1
+            print("Hash is corrected. (%d/%d) %s"%(self.nDone, self.nFiles, src))
+        if self.delete_flag:
+            ## Only after a verified match
+            os.remove(src)
+            print("Removed the copied file.(%s)"%(src))
+        return True
     def doMigration(self):
         if ( self.nFiles==0):
             print("No file copied. Terminate program.")
-        for idx, src in enumerate(self.source):
-            cmd = "xrdcp -p %s %s"%(src,self.dest[src])
-            print("Copying file (%d/%d)"%(idx+1,self.nFiles))
-            print(cmd)
-            if not self.dryrun:
-                os.system(cmd)
-                out, err = subprocess_open("xrdadler32 %s"%(src))
-                srcHash  = out.decode('utf-8').split()[0]
-                out, err = subprocess_open("xrdadler32 %s"%(self.dest[src]))
-                destHash = out.decode('utf-8').split()[0]
-                if srcHash==destHash:
-                    print("Hash is corrected.")
-                    if self.delete_flag:
-                        cmd = "rm -f %s"%(src)
-                        print("Removed the copied file.(%s)"%(src))
-                        os.system(cmd)
+        if self.dryrun:
+            for idx, src in enumerate(self.source):
+                print("Copying file (%d/%d)"%(idx+1,self.nFiles))
+                print("xrdcp -p %s %s"%(src,self.dest[src]))
+        else:
+            self.cache = ChecksumCache(self.cacheFile)
+            self.lock = threading.Lock()
+            self.nDone = 0
+            self.failed = []
+            begin = time.time()
+            with ThreadPoolExecutor(max_workers=self.nparallel) as hashPool:
+                with ThreadPoolExecutor(max_workers=self.nparallel) as copyPool:
+                    list(copyPool.map(lambda src: self.migrateFile(src, hashPool), self.source))
+            print("Verified %d/%d files in %.1f s, local checksums from the cache: %d"%(self.nDone, self.nFiles, time.time()-begin, self.cache.nHit))
+            self.cache.close()
+            if len(self.failed) > 0:
+                with open("xrdMigration_failed.txt", "w") as f:
+                    for src in self.failed: f.write("%s\n"%(src))
+                print("%d files are not verified, see xrdMigration_failed.txt. They are not deleted."%(len(self.failed)))
         for sdir in self.srcdirs:
             destdir = self.destdir[sdir]
             cmd = "xrdfs cms-xrdr.private.lo:2094 locate -r %s"%(destdir)